@@ -1,20 +1,37 @@
 # cfn-tmpl-invoked-by.py
 
 import json
+import mmap
 import os
+import stat
 import sys
 import argparse
 from collections import defaultdict
 
+# orjson is optional; it parses large data files considerably faster than the stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def load_data(filepath):
     """Loads the resource data from the JSON file."""
     if not os.path.exists(filepath):
         print(f"Error: Input file not found at '{filepath}'", file=sys.stderr)
         sys.exit(1)
     try:
+        if orjson is not None:
+            with open(filepath, 'rb') as f:
+                st = os.fstat(f.fileno())
+                # mmap needs a non-empty regular file; read pipes, FIFOs and empty files normally
+                if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                    return orjson.loads(f.read())
+                # Parse straight from the mapped file instead of copying it into a bytes object first
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as buf:
+                    return orjson.loads(buf)
         with open(filepath, 'r') as f:
             return json.load(f)
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e: # orjson.JSONDecodeError is a subclass
         print(f"Error: Could not decode JSON data file {filepath}. Error: {e}", file=sys.stderr)
         sys.exit(1)
     except IOError as e:
@@ -24,53 +41,95 @@ def load_data(filepath):
 def calculate_invoked_by(data):
     """Calculates the invoked_by list for each resource based on invokes lists."""
     print("Calculating invoked_by relationships...")
-    # Ensure every resource has an 'invoked_by' list initialized
-    for logical_id in data:
-        data[logical_id]['invoked_by'] = []
+    # Collect invoker names per target first; the invoked_by entries are built once afterwards
+    invokers_by_target = defaultdict(list)
 
-    # Iterate through all resources to find who invokes whom
-    for invoker_id, invoker_data in data.items():
-        invoker_type = invoker_data.get('type', 'Unknown')
-        invoker_account = invoker_data.get('account_name', 'Unknown')
+    # Only resources with a non-empty invokes list can be invokers; skip the rest up front
+    invoker_ids = [logical_id for logical_id, resource in data.items() if resource.get('invokes')]
 
-        for target_info in invoker_data.get('invokes', []):
+    # Iterate through the invokers in name order to find who invokes whom, so that
+    # each target's invoker list comes out already sorted
+    for invoker_id in sorted(invoker_ids):
+        for target_info in data[invoker_id]['invokes']:
             target_id = target_info.get('name')
             if not target_id:
                 print(f"Warning: Found invoke entry with no name for invoker '{invoker_id}'. Skipping.", file=sys.stderr)
                 continue
 
             if target_id in data:
-                # Add the invoker to the target's invoked_by list
-                target_resource = data[target_id]
-                invoker_details = {
-                    "name": invoker_id,
-                    "type": invoker_type,
-                    "account_name": invoker_account
-                }
-                # Avoid adding duplicates if script runs multiple times on same input
-                if invoker_details not in target_resource['invoked_by']:
-                    target_resource['invoked_by'].append(invoker_details)
+                invokers = invokers_by_target[target_id]
+                # Invokers arrive in name order, so a duplicate can only be the last entry
+                if not invokers or invokers[-1] != invoker_id:
+                    invokers.append(invoker_id)
             else:
                 # This case means the parser found an 'invokes' relationship
                 # pointing to a resource not defined in any parsed template.
                 print(f"Warning: Resource '{invoker_id}' invokes '{target_id}', but '{target_id}' was not found in the combined resource data.", file=sys.stderr)
 
-    # Sort the invoked_by lists for consistency
-    for logical_id in data:
-        data[logical_id]['invoked_by'].sort(key=lambda x: x['name'])
+    # Build each invoker's entry once and share it across all of its targets.
+    # Types and account names repeat heavily, so intern them and let the resource
+    # point at the shared copy too, freeing the duplicates created by the JSON parser.
+    invoker_details_by_id = {}
+    for invoker_id, invoker_data in data.items():
+        invoker_type = invoker_data.get('type', 'Unknown')
+        invoker_account = invoker_data.get('account_name', 'Unknown')
+        # The parser writes null for a resource without a Type; only strings can be interned
+        if isinstance(invoker_type, str):
+            invoker_type = sys.intern(invoker_type)
+        if isinstance(invoker_account, str):
+            invoker_account = sys.intern(invoker_account)
+        if 'type' in invoker_data:
+            invoker_data['type'] = invoker_type
+        if 'account_name' in invoker_data:
+            invoker_data['account_name'] = invoker_account
+        invoker_details_by_id[invoker_id] = {
+            "name": invoker_id,
+            "type": invoker_type,
+            "account_name": invoker_account
+        }
+
+    # Materialize the invoked_by lists; resources nobody invokes get an empty list
+    for logical_id, resource in data.items():
+        resource['invoked_by'] = [
+            invoker_details_by_id[invoker_id]
+            for invoker_id in invokers_by_target.get(logical_id, ())
+        ]
 
     print("Finished calculating invoked_by relationships.")
     return data
 
-def write_data(data, filepath):
+def write_data(data, filepath, compact=False):
     """Writes the updated resource data (including invoked_by) back to the JSON file."""
+    # Serialize in one shot and write once instead of streaming many small chunks.
+    # Compact output skips all whitespace and goes through the C encoder, which is much faster.
+    if compact:
+        output = json.dumps(data, separators=(',', ':'))
+    else:
+        output = json.dumps(data, indent=4)
+
+    # Don't rewrite a file that already holds exactly this output (relationships and formatting).
+    # The output is ASCII (ensure_ascii), so its length is its size on disk.
+    try:
+        if os.path.getsize(filepath) == len(output):
+            with open(filepath, 'r') as f:
+                if f.read() == output:
+                    print(f"Data in {filepath} is already up to date. Skipping write.")
+                    return
+    except OSError:
+        pass # Missing or unreadable; just write it
+
     print(f"Writing updated data (including invoked_by) to {filepath}...")
+    # Write to a temporary file and swap it in, so a failed write never leaves a truncated data file
+    tmp_filepath = f"{filepath}.tmp"
     try:
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=4)
+        with open(tmp_filepath, 'w') as f:
+            f.write(output)
+        os.replace(tmp_filepath, filepath)
         print(f"Successfully wrote updated data to {filepath}.")
     except IOError as e:
         print(f"Error writing updated data to file {filepath}: {e}", file=sys.stderr)
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -83,6 +142,11 @@ if __name__ == "__main__":
         default="resources.json", # Default to resources.json
         help="Path to the input/output JSON data file (default: resources.json)"
     )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Write JSON without indentation or spaces (smaller and faster to write, harder to read)"
+    )
 
     args = parser.parse_args()
     data_file_path = args.data_file
@@ -93,5 +157,5 @@ if __name__ == "__main__":
     # Calculate invoked_by
     updated_data = calculate_invoked_by(resource_data)
 
-    # Write updated data
-    write_data(updated_data, data_file_path)
+    # Write updated data (skipped if the file is already identical)
+    write_data(updated_data, data_file_path, compact=args.compact)
@@ -4,9 +4,20 @@ import yaml
 import json
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+import logging
 import os
 import re
-from collections import defaultdict
+
+# orjson is optional; it parses JSON considerably faster than the stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Per-resource relationship details are logged at DEBUG level (shown with -v); warnings are always shown
+logger = logging.getLogger("cfn-tmpl-invokes")
 
 # --- YAML Loader Setup for CFN Tags --- START
 def default_constructor(loader, tag_suffix, node):
@@ -27,7 +38,13 @@ def default_constructor(loader, tag_suffix, node):
         raise yaml.constructor.ConstructorError(
             None, None, f"unexpected node type {node.__class__} for tag {tag_suffix}", node.start_mark)
 
-yaml.add_multi_constructor('!', default_constructor, Loader=yaml.SafeLoader)
+# Prefer the LibYAML-backed loader when PyYAML was built with it; it is several times faster
+try:
+    CfnLoader = yaml.CSafeLoader
+except AttributeError:
+    CfnLoader = yaml.SafeLoader
+
+yaml.add_multi_constructor('!', default_constructor, Loader=CfnLoader)
 # --- YAML Loader Setup for CFN Tags --- END
 
 # --- Resource Type Mapping ---
@@ -63,6 +80,8 @@ CFN_TYPE_MAP = {
     "AWS::Service::APIGateway": "API Gateway Service",
     "AWS::Service::SQS": "SQS Service", # If SQS is identified as external principal
 }
+# Template types are interned on load; interning the keys too lets lookups match by identity
+CFN_TYPE_MAP = {sys.intern(k): v for k, v in CFN_TYPE_MAP.items()}
 
 # Map service principals to pseudo-resource IDs and types
 SERVICE_PRINCIPAL_MAP = {
@@ -73,69 +92,748 @@ SERVICE_PRINCIPAL_MAP = {
     # Add other service principals as needed
 }
 
+# Resource types that are Lambda functions once deployed
+LAMBDA_FUNCTION_TYPES = frozenset({"AWS::Lambda::Function", "AWS::Serverless::Function"})
+
+# IAM actions that let a role's holder invoke another resource
+LAMBDA_ROLE_INVOKE_ACTIONS = frozenset({'lambda:InvokeFunction'})
+STATE_MACHINE_ROLE_INVOKE_ACTIONS = frozenset({'lambda:InvokeFunction', 'states:StartExecution'})
+
+# --- Precompiled Reference Patterns ---
+# ${LogicalId} or ${LogicalId.Attribute} inside Fn::Sub strings
+SUB_REF_PATTERN = re.compile(r'\${([a-zA-Z0-9]+)(?:\.[a-zA-Z0-9]+)?}')
+# ${LogicalId} or ${LogicalId.Arn} placeholders substituted in Step Function definitions
+SUB_ARN_PATTERN = re.compile(r'\${([a-zA-Z0-9]+)(?:\.Arn)?}')
+# Lambda function name/ref inside an API Gateway AuthorizerUri
+AUTHORIZER_URI_PATTERN = re.compile(r'functions/arn:aws:lambda:[^:]+:[^:]+:function:([^/]+)/invocations')
+
 
 # --- Helper Function to Extract References --- START
-def find_logical_ids(data, defined_logical_ids):
-    """Recursively finds potential Logical IDs referenced within data structures."""
+def find_logical_ids(data, defined_logical_ids, cache=None):
+    """Recursively finds potential Logical IDs referenced within data structures.
+
+    If a cache dict is given, results for dict/list nodes are memoized in it by object id,
+    so subtrees visited more than once during a template parse are only walked once.
+    ${...} matches of strings are memoized in it by the string value.
+    """
     refs = set()
-    # Allow service IDs (like 'S3') to be considered "defined" for reference finding
-    # This helps if !Ref S3 somehow exists, though unlikely for service pseudo-resources
-    all_ids = defined_logical_ids.union(set(SERVICE_PRINCIPAL_MAP.get(p, {}).get('id') for p in SERVICE_PRINCIPAL_MAP))
+    if defined_logical_ids: # Nothing can match otherwise, so don't walk the data at all
+        collect_logical_ids(data, defined_logical_ids, refs, cache)
+    return refs
+
+def find_sub_targets(sub_input, defined_logical_ids):
+    """Returns the Logical IDs referenced by an Fn::Sub argument (string or [string, variables] form)."""
+    if isinstance(sub_input, str):
+        sub_string = sub_input
+        # Also check for direct references if the string itself is an ID (less common)
+        targets = {sys.intern(sub_string)} if sub_string in defined_logical_ids else set()
+    else:
+        sub_string = sub_input[0]
+        targets = set()
+    # Find potential IDs within the ${...} syntax
+    targets.update(sys.intern(ref_id) for ref_id in SUB_REF_PATTERN.findall(sub_string) if ref_id in defined_logical_ids)
+    return targets
+
+def collect_logical_ids(data, defined_logical_ids, refs, cache=None):
+    """Adds the Logical IDs referenced within data to the refs set (see find_logical_ids)."""
+    # Only references *to* defined resources are of interest, so candidates are checked
+    # against defined_logical_ids directly. Service pseudo-IDs (like 'S3') invoke others,
+    # but aren't referenced *by* others, so they never need to match.
+    # Matches are interned, so every reference to a resource shares the (interned) defined ID.
+    if isinstance(data, str):
+        # Check for patterns like "LogicalId.Arn" resulting from !GetAtt after YAML load
+        dot = data.find('.')
+        if dot > 0:
+            # Slice off the prefix rather than splitting the whole string into segments
+            potential_id = data[:dot]
+            if potential_id in defined_logical_ids:
+                refs.add(sys.intern(potential_id))
+        # Check for ${LogicalId} patterns within strings; most scalars have no '$', so skip the regex for them
+        if '$' in data:
+            # Substitution strings repeat across resources (ARNs, URIs), so memoize their matches by value
+            sub_refs = cache.get(data) if cache is not None else None
+            if sub_refs is None:
+                sub_refs = frozenset(sys.intern(ref_id) for ref_id in SUB_REF_PATTERN.findall(data) if ref_id in defined_logical_ids)
+                if cache is not None:
+                    cache[data] = sub_refs
+            refs.update(sub_refs)
+        # Check if the string itself is a direct reference
+        if data in defined_logical_ids:
+             refs.add(sys.intern(data))
+        return
+
+    if not isinstance(data, (dict, list)):
+        return
+
+    if cache is not None:
+        cached = cache.get(id(data))
+        if cached is not None:
+            refs.update(cached[1])
+            return
+        # Collect this subtree on its own so the result can be memoized
+        node_refs = set()
+    else:
+        node_refs = refs
 
     if isinstance(data, dict):
         # Check for CloudFormation functions like !Ref, !GetAtt, !Sub
-        if 'Ref' in data and isinstance(data['Ref'], str) and data['Ref'] in all_ids:
-            refs.add(data['Ref'])
-        elif 'Fn::GetAtt' in data and isinstance(data['Fn::GetAtt'], list) and len(data['Fn::GetAtt']) > 0 and data['Fn::GetAtt'][0] in all_ids:
+        if 'Ref' in data and isinstance(data['Ref'], str) and data['Ref'] in defined_logical_ids:
+            node_refs.add(sys.intern(data['Ref']))
+        elif 'Fn::GetAtt' in data and isinstance(data['Fn::GetAtt'], list) and len(data['Fn::GetAtt']) > 0 and data['Fn::GetAtt'][0] in defined_logical_ids:
             # Only add if the base resource ID is known
-            refs.add(data['Fn::GetAtt'][0])
+            base_id = data['Fn::GetAtt'][0]
+            node_refs.add(sys.intern(base_id) if isinstance(base_id, str) else base_id)
         elif 'Fn::Sub' in data:
-            sub_input = data['Fn::Sub']
-            sub_string = sub_input if isinstance(sub_input, str) else sub_input[0]
-            # Find potential IDs within the ${...} syntax
-            found_refs = re.findall(r'\${([a-zA-Z0-9]+)(?:\.[a-zA-Z0-9]+)?}', sub_string)
-            for ref_id in found_refs:
-                if ref_id in all_ids:
-                    refs.add(ref_id)
-            # Also check for direct references if sub_string itself is an ID (less common)
-            if isinstance(sub_input, str) and sub_input in all_ids:
-                 refs.add(sub_input)
+            node_refs.update(find_sub_targets(data['Fn::Sub'], defined_logical_ids))
 
         else:
             # Recursively check dictionary values
-            for key, value in data.items():
-                refs.update(find_logical_ids(value, defined_logical_ids)) # Pass original defined_logical_ids down
-    elif isinstance(data, list):
+            for value in data.values():
+                collect_logical_ids(value, defined_logical_ids, node_refs, cache)
+    else:
         # Recursively check list items
         for item in data:
-            refs.update(find_logical_ids(item, defined_logical_ids)) # Pass original defined_logical_ids down
-    elif isinstance(data, str):
-        # Check for patterns like "LogicalId.Arn" resulting from !GetAtt after YAML load
-        if '.' in data:
-            potential_id = data.split('.')[0]
-            if potential_id in all_ids:
-                refs.add(potential_id)
-        # Check for ${LogicalId} patterns within strings
-        found_refs = re.findall(r'\${([a-zA-Z0-9]+)(?:\.[a-zA-Z0-9]+)?}', data)
-        for ref_id in found_refs:
-            if ref_id in all_ids:
-                refs.add(ref_id)
-        # Check if the string itself is a direct reference
-        if data in all_ids:
-             refs.add(data)
-
-    # Filter out any service pseudo-IDs found if they weren't originally defined resources
-    # We only care about references *to* defined resources within properties.
-    # Service pseudo-resources invoke others, but aren't typically referenced *by* others.
-    return refs.intersection(defined_logical_ids)
+            collect_logical_ids(item, defined_logical_ids, node_refs, cache)
+
+    if cache is not None:
+        # Keep the node itself alive alongside the result so its id cannot be reused by another object
+        cache[id(data)] = (data, frozenset(node_refs))
+        refs.update(node_refs)
+
+def find_role_invoke_targets(role_props, allowed_actions, defined_logical_ids, cache=None):
+    """Finds Logical IDs in the Resource of inline role policy statements that Allow any of allowed_actions."""
+    targets = set()
+    for policy in role_props.get('Policies', []):
+        statements = (policy.get('PolicyDocument') or {}).get("Statement", [])
+        for statement in statements:
+            if statement.get('Effect') != 'Allow':
+                continue
+            action = statement.get('Action', [])
+            if not isinstance(action, list): action = [action]
+            # Actions may be intrinsic function dicts, which can't be looked up in a frozenset
+            if not any(isinstance(a, str) and a in allowed_actions for a in action):
+                continue
+            policy_resources = statement.get('Resource', [])
+            if not isinstance(policy_resources, list): policy_resources = [policy_resources]
+            collect_logical_ids(policy_resources, defined_logical_ids, targets, cache)
+    return targets
 
 # --- Helper Function to Extract References --- END
 
+# --- Resource Type Handlers --- START
+# Each handler records the invokes relationships for one resource of its type.
+# context holds the per-template state shared by all handlers (see parse_cloudformation).
+
+def get_relation_entry(parsed_relations, res_id):
+    """Returns the entry for res_id, creating one with an empty invokes set if it doesn't exist yet."""
+    entry = parsed_relations.get(res_id)
+    if entry is None:
+        entry = parsed_relations[res_id] = {"invokes": set()}
+    return entry
+
+def ensure_relation_entry(parsed_relations, res_id, original_type, entry_account):
+    """Creates the entry for a (pseudo-)resource with the given type and account unless it already exists."""
+    if res_id not in parsed_relations:
+        parsed_relations[res_id] = {"invokes": set(), "_original_type": original_type, "account_name": entry_account}
+    return parsed_relations[res_id]
+
+def get_role_invoke_targets(role_logical_id, allowed_actions, context):
+    """Returns find_role_invoke_targets for a role in this template, scanning each role/action set only once."""
+    role_invoke_cache = context['role_invoke_cache']
+    cache_key = (role_logical_id, allowed_actions)
+    if cache_key not in role_invoke_cache:
+        role_invoke_cache[cache_key] = frozenset(find_role_invoke_targets(
+            context['role_props_by_id'][role_logical_id], allowed_actions, context['defined_logical_ids'], context['ref_cache']))
+    return role_invoke_cache[cache_key]
+
+def handle_lambda_function(logical_id, cfn_type, properties, context):
+    """Lambda/SAM functions: environment references, role invoke permissions, SAM Events and DLQ."""
+    defined_logical_ids = context['defined_logical_ids']
+    type_by_id = context['type_by_id']
+    role_props_by_id = context['role_props_by_id']
+    parsed_relations = context['parsed_relations']
+    account_name = context['account_name']
+    ref_cache = context['ref_cache']
+
+    # Env vars often mean Lambda -> Target
+    env_vars = (properties.get('Environment') or {}).get('Variables')
+    refs_in_env = find_logical_ids(env_vars, defined_logical_ids, ref_cache)
+    for ref_id in refs_in_env:
+        logger.debug("%s (%s Env) -> %s", logical_id, cfn_type, ref_id)
+        parsed_relations[logical_id]['invokes'].add(ref_id)
+
+    # Check Role for lambda:InvokeFunction permissions
+    role_ref = properties.get('Role') # Works for Function and Serverless::Function
+    role_ids = find_logical_ids(role_ref, defined_logical_ids, ref_cache)
+    if role_ids:
+        role_logical_id = next(iter(role_ids)) # Assuming one role
+        # Need to check if the Role resource itself exists in the template
+        if role_logical_id in role_props_by_id:
+             # Also check ManagedPolicyArns if applicable (more complex to parse)
+             # Simple check in inline policies
+             refs_in_policy_res = get_role_invoke_targets(role_logical_id, LAMBDA_ROLE_INVOKE_ACTIONS, context)
+
+             for target_lambda_id in refs_in_policy_res:
+                 # Ensure the target is actually a Lambda defined in the template
+                 if type_by_id.get(target_lambda_id) in LAMBDA_FUNCTION_TYPES:
+                     logger.debug("%s (%s via Role Invoke) -> %s", logical_id, cfn_type, target_lambda_id)
+                     parsed_relations[logical_id]['invokes'].add(target_lambda_id)
+
+    # Handle SAM 'Events' shorthand for Serverless::Function
+    if cfn_type == "AWS::Serverless::Function":
+        events = properties.get('Events') or {}
+        for event_name, event_details in events.items():
+            event_type = event_details.get('Type')
+            event_props = event_details.get('Properties') or {}
+
+            # Example for SQS Event
+            if event_type == 'SQS':
+                queue_ref = event_props.get('Queue')
+                queue_ids = find_logical_ids(queue_ref, defined_logical_ids, ref_cache)
+                if queue_ids:
+                    queue_logical_id = next(iter(queue_ids))
+                    # Queue invokes this Lambda
+                    logger.debug("%s (SQS Event Source for SAM) -> %s", queue_logical_id, logical_id)
+                    get_relation_entry(parsed_relations, queue_logical_id)['invokes'].add(logical_id)
+                else:
+                    logger.warning("Warning: Could not resolve SQS Queue reference '%s' for SAM Function '%s' event '%s'.", queue_ref, logical_id, event_name)
+            # Add handlers for other SAM Event types (API, Schedule, S3, etc.) here
+            # Example for API Event (more complex, involves implicit API GW resources)
+            elif event_type == 'Api':
+                 # This implies an API Gateway invokes this function.
+                 # We might need to create a pseudo API GW resource or link to an existing one.
+                 # For simplicity, we could use a generic 'APIGateway' pseudo-resource if not explicitly defined.
+                 api_gw_pseudo_id = 'APIGateway' # Default pseudo-ID
+                 rest_api_id_ref = event_props.get('RestApiId') # Check if linked to specific API
+                 if rest_api_id_ref:
+                     resolved_api_ids = find_logical_ids(rest_api_id_ref, defined_logical_ids, ref_cache)
+                     if resolved_api_ids:
+                         api_gw_pseudo_id = next(iter(resolved_api_ids)) # Use the actual logical ID
+
+                 logger.debug("%s (API Event Source for SAM) -> %s", api_gw_pseudo_id, logical_id)
+                 # Ensure the API GW resource exists in our structure
+                 ensure_relation_entry(parsed_relations, api_gw_pseudo_id, 'AWS::ApiGateway::RestApi', account_name)['invokes'].add(logical_id)
+            # --- NEW: Handle other SAM Event Types ---
+            elif event_type == 'S3':
+                bucket_ref = event_props.get('Bucket')
+                if bucket_ref:
+                     # S3 Bucket Event invokes this Lambda
+                     s3_service_id = 'S3' # Use pseudo-resource ID
+                     s3_service_type = 'AWS::Service::S3'
+                     logger.debug("%s (S3 Event Source for SAM via Bucket Ref: %s) -> %s", s3_service_id, bucket_ref, logical_id)
+                     # Ensure S3 pseudo-resource exists
+                     ensure_relation_entry(parsed_relations, s3_service_id, s3_service_type, 'AWS')['invokes'].add(logical_id)
+                else:
+                     logger.warning("Warning: SAM S3 Event for '%s' missing Bucket property.", logical_id)
+
+            elif event_type == 'SNS':
+                topic_ref = event_props.get('Topic')
+                topic_ids = find_logical_ids(topic_ref, defined_logical_ids, ref_cache)
+                if topic_ids:
+                    topic_logical_id = next(iter(topic_ids))
+                    # SNS Topic invokes this Lambda
+                    logger.debug("%s (SNS Event Source for SAM) -> %s", topic_logical_id, logical_id)
+                    get_relation_entry(parsed_relations, topic_logical_id)['invokes'].add(logical_id)
+                else:
+                    logger.warning("Warning: Could not resolve SNS Topic reference '%s' for SAM Function '%s' event '%s'.", topic_ref, logical_id, event_name)
+
+            elif event_type == 'DynamoDB':
+                stream_ref = event_props.get('Stream')
+                # Stream ARN is usually !GetAtt Table.StreamArn
+                # We need to resolve the Table ID from this
+                table_ids = set()
+                if isinstance(stream_ref, dict) and 'Fn::GetAtt' in stream_ref:
+                    getatt_list = stream_ref['Fn::GetAtt']
+                    if isinstance(getatt_list, list) and len(getatt_list) > 0 and getatt_list[0] in defined_logical_ids:
+                        table_ids.add(getatt_list[0])
+                elif isinstance(stream_ref, str):
+                     # Less common, maybe direct ARN reference - try to find base ID
+                     collect_logical_ids(stream_ref, defined_logical_ids, table_ids, ref_cache)
+
+                if table_ids:
+                    table_logical_id = next(iter(table_ids))
+                     # DynamoDB Table Stream invokes this Lambda
+                    logger.debug("%s (DynamoDB Event Source for SAM) -> %s", table_logical_id, logical_id)
+                    get_relation_entry(parsed_relations, table_logical_id)['invokes'].add(logical_id)
+                else:
+                    logger.warning("Warning: Could not resolve DynamoDB Table from Stream '%s' for SAM Function '%s' event '%s'.", stream_ref, logical_id, event_name)
+
+            elif event_type == 'Schedule':
+                 # EventBridge Schedule invokes this Lambda
+                 eb_service_id = 'EventBridge' # Use pseudo-resource ID
+                 eb_service_type = 'AWS::Service::EventBridge'
+                 # Schedule name/ARN might be in event_props.Schedule, but not always a defined resource
+                 logger.debug("%s (Schedule Event Source for SAM) -> %s", eb_service_id, logical_id)
+                 # Ensure EventBridge pseudo-resource exists
+                 ensure_relation_entry(parsed_relations, eb_service_id, eb_service_type, 'AWS')['invokes'].add(logical_id)
+
+    # --- NEW: Handle Lambda Dead Letter Queue (DLQ) ---
+    dlq_config = properties.get('DeadLetterConfig')
+    if isinstance(dlq_config, dict):
+         target_arn_ref = dlq_config.get('TargetArn')
+         dlq_ids = find_logical_ids(target_arn_ref, defined_logical_ids, ref_cache)
+         if dlq_ids:
+             dlq_logical_id = next(iter(dlq_ids))
+             # Lambda sends failed events to the DLQ (SQS or SNS)
+             logger.debug("%s (Lambda DLQ) -> %s", logical_id, dlq_logical_id)
+             parsed_relations[logical_id]['invokes'].add(dlq_logical_id)
+         elif target_arn_ref:
+             logger.warning("Warning: Could not resolve DLQ TargetArn '%s' for Lambda '%s'.", target_arn_ref, logical_id)
+
+def handle_api_gateway_method(logical_id, cfn_type, properties, context):
+    """API Gateway Methods: the method and its RestApi invoke the integration target."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    account_name = context['account_name']
+    ref_cache = context['ref_cache']
+
+    integration = properties.get('Integration') or {}
+    refs_in_uri = find_logical_ids(integration.get('Uri'), defined_logical_ids, ref_cache)
+    for ref_id in refs_in_uri:
+        # Method invokes target (usually Lambda)
+        logger.debug("%s (API Method) -> %s", logical_id, ref_id)
+        parsed_relations[logical_id]['invokes'].add(ref_id)
+        # Also infer parent RestApi invokes target
+        api_ref = properties.get('RestApiId')
+        api_ids = find_logical_ids(api_ref, defined_logical_ids, ref_cache)
+        if api_ids:
+            api_logical_id = next(iter(api_ids))
+            logger.debug("%s (API Gateway) -> %s", api_logical_id, ref_id)
+            # Ensure API Gateway exists and add invoke
+            ensure_relation_entry(parsed_relations, api_logical_id, 'AWS::ApiGateway::RestApi', account_name)['invokes'].add(ref_id)
+
+def loads_json(text):
+    """Parses a JSON string with orjson when available, otherwise the stdlib json module."""
+    if orjson is not None:
+        return orjson.loads(text) # orjson.JSONDecodeError is a json.JSONDecodeError subclass
+    return json.loads(text)
+
+def substitute_sub_arns(sub_string_template, arn_by_id):
+    """Replaces ${LogicalId}/${LogicalId.Arn} placeholders with a known Arn property, or the ID itself."""
+    # Attempt to resolve - this is tricky without full context
+    # For now, just return the ID, find_logical_ids will catch it later if it's simple
+    return SUB_ARN_PATTERN.sub(lambda match: arn_by_id.get(match.group(1), match.group(1)), sub_string_template)
+
+def handle_state_machine(logical_id, cfn_type, properties, context):
+    """Step Functions: role invoke permissions and Task states in the definition."""
+    resources = context['resources']
+    defined_logical_ids = context['defined_logical_ids']
+    role_props_by_id = context['role_props_by_id']
+    arn_by_id = context['arn_by_id']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    # Check RoleArn for permissions to invoke other resources
+    role_ref = properties.get('RoleArn')
+    role_ids = find_logical_ids(role_ref, defined_logical_ids, ref_cache)
+    if role_ids:
+        role_logical_id = next(iter(role_ids))
+        if role_logical_id in role_props_by_id:
+             # Check inline policies for lambda:InvokeFunction, states:StartExecution, etc.
+             refs_in_policy_res = get_role_invoke_targets(role_logical_id, STATE_MACHINE_ROLE_INVOKE_ACTIONS, context)
+             for target_id in refs_in_policy_res:
+                 if target_id in resources: # Ensure target is defined here
+                      logger.debug("%s (Step Function via Role) -> %s", logical_id, target_id)
+                      parsed_relations[logical_id]['invokes'].add(target_id)
+    # TODO: Parse DefinitionString/Definition for Task states invoking Lambdas/other SFNs
+    # --- NEW: Parse State Machine Definition ---
+    definition = properties.get('Definition')
+    definition_string = properties.get('DefinitionString')
+
+    sfn_definition_json = None
+    if isinstance(definition, dict): # Definition is already JSON/dict
+        sfn_definition_json = definition
+    elif isinstance(definition_string, str): # DefinitionString needs parsing
+        try:
+            # Handle potential !Sub in DefinitionString
+            if 'Fn::Sub' in definition_string:
+                sub_input = definition_string['Fn::Sub']
+                sub_string_template = sub_input if isinstance(sub_input, str) else sub_input[0]
+                # Very basic substitution - assumes ${LogicalId} or ${LogicalId.Arn}
+                # A more robust solution would need context of Sub variables if provided
+                processed_string = substitute_sub_arns(sub_string_template, arn_by_id)
+                sfn_definition_json = loads_json(processed_string)
+            else:
+                sfn_definition_json = loads_json(definition_string)
+        except json.JSONDecodeError as e:
+            logger.error("Warning: Could not parse JSON in DefinitionString for %s: %s", logical_id, e)
+        except Exception as e:
+            logger.error("Warning: Error processing DefinitionString for %s: %s", logical_id, e)
+    elif isinstance(definition_string, dict) and 'Fn::Sub' in definition_string:
+         # Handle cases where DefinitionString is itself an Fn::Sub object
+         try:
+            sub_input = definition_string['Fn::Sub']
+            sub_string_template = sub_input if isinstance(sub_input, str) else sub_input[0]
+            # Basic substitution again
+            processed_string = substitute_sub_arns(sub_string_template, arn_by_id)
+            sfn_definition_json = loads_json(processed_string)
+         except Exception as e:
+            logger.error("Warning: Error processing Fn::Sub DefinitionString for %s: %s", logical_id, e)
+
+
+    if sfn_definition_json and 'States' in sfn_definition_json:
+        states = sfn_definition_json['States']
+        # Walk Task states, following nested Map and Parallel states with an explicit stack
+        def find_task_refs(root_states):
+            refs = set()
+            pending_states = [root_states]
+            while pending_states:
+                current_states = pending_states.pop()
+                for state_name, state_data in current_states.items():
+                    state_type = state_data.get('Type')
+                    if state_type == 'Task':
+                        resource_arn = state_data.get('Resource')
+                        parameters = state_data.get('Parameters')
+                        # Check resource ARN string
+                        if isinstance(resource_arn, str):
+                            collect_logical_ids(resource_arn, defined_logical_ids, refs, ref_cache)
+                        # Check parameters for relevant ARNs/Refs (FunctionName, StateMachineArn, QueueUrl,
+                        # TopicArn, ...); every value is searched, so no key filtering is needed
+                        if isinstance(parameters, dict):
+                            for param_value in parameters.values():
+                                collect_logical_ids(param_value, defined_logical_ids, refs, ref_cache)
+                    elif state_type == 'Map':
+                        iterator = state_data.get('Iterator')
+                        if iterator and 'States' in iterator:
+                            pending_states.append(iterator['States'])
+                    elif state_type == 'Parallel':
+                        for branch in state_data.get('Branches', []):
+                            if 'States' in branch:
+                                pending_states.append(branch['States'])
+            return refs
+
+        task_invoked_ids = find_task_refs(states)
+        for target_id in task_invoked_ids:
+            # Check if it's a resource defined in this template
+            if target_id in resources:
+                 logger.debug("%s (Step Function Definition) -> %s", logical_id, target_id)
+                 parsed_relations[logical_id]['invokes'].add(target_id)
+            else:
+                 # Might be a direct ARN or resource in another stack
+                 logger.debug("Info: Step Function %s definition references external/ARN: %s", logical_id, target_id)
+                 # Optionally add as Unknown/External if desired, but sticking to known resources for now
+
+def handle_s3_bucket(logical_id, cfn_type, properties, context):
+    """S3 Bucket notifications: the S3 service invokes the configured Lambda/SQS/SNS targets."""
+    resources = context['resources']
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    notification_config = properties.get('NotificationConfiguration')
+    if isinstance(notification_config, dict):
+        # Define service ID for S3
+        s3_service_id = 'S3' # Consistent with Lambda:Permission handling
+        s3_service_type = 'AWS::Service::S3'
+
+        targets_found = False
+        invoked_targets = set()
+
+        # Check Lambda configurations
+        for config in notification_config.get('LambdaConfigurations', []):
+            func_arn = config.get('Function')
+            if func_arn:
+                collect_logical_ids(func_arn, defined_logical_ids, invoked_targets, ref_cache)
+                targets_found = True
+
+        # Check SQS configurations
+        for config in notification_config.get('QueueConfigurations', []):
+            queue_arn = config.get('Queue')
+            if queue_arn:
+                collect_logical_ids(queue_arn, defined_logical_ids, invoked_targets, ref_cache)
+                targets_found = True
+
+        # Check SNS configurations
+        for config in notification_config.get('TopicConfigurations', []):
+            topic_arn = config.get('Topic')
+            if topic_arn:
+                collect_logical_ids(topic_arn, defined_logical_ids, invoked_targets, ref_cache)
+                targets_found = True
+
+        # If any targets found, ensure S3 pseudo-resource exists and add invokes
+        if targets_found:
+            s3_invokes = ensure_relation_entry(parsed_relations, s3_service_id, s3_service_type, 'AWS')['invokes']
+
+            for target_id in invoked_targets:
+                 if target_id in resources:
+                    logger.debug("%s (S3 Notification via Bucket %s) -> %s", s3_service_id, logical_id, target_id)
+                    s3_invokes.add(target_id)
+                 else:
+                    logger.debug("Info: S3 Bucket %s notification references external/ARN: %s", logical_id, target_id)
+
+def handle_sns_subscription(logical_id, cfn_type, properties, context):
+    """Explicit SNS Subscriptions: the topic invokes a Lambda or SQS endpoint."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    topic_arn_ref = properties.get('TopicArn')
+    endpoint_ref = properties.get('Endpoint') # Can be Lambda ARN, SQS ARN, etc.
+    protocol = properties.get('Protocol') # e.g., 'lambda', 'sqs'
+
+    if topic_arn_ref and endpoint_ref and protocol in ['lambda', 'sqs']: # Focus on Lambda/SQS for now
+        topic_ids = find_logical_ids(topic_arn_ref, defined_logical_ids, ref_cache)
+        endpoint_ids = find_logical_ids(endpoint_ref, defined_logical_ids, ref_cache)
+
+        if topic_ids and endpoint_ids:
+            topic_logical_id = next(iter(topic_ids))
+            endpoint_logical_id = next(iter(endpoint_ids))
+
+            # The Topic is a defined resource, so its entry already exists regardless of template order
+            logger.debug("%s (SNS Topic via Subscription) -> %s", topic_logical_id, endpoint_logical_id)
+            parsed_relations[topic_logical_id]['invokes'].add(endpoint_logical_id)
+        else:
+             logger.warning("Warning: Could not resolve TopicArn (%s) or Endpoint (%s) for Subscription '%s'.", topic_arn_ref, endpoint_ref, logical_id)
+
+def handle_events_rule(logical_id, cfn_type, properties, context):
+    """EventBridge Rules: the rule invokes each target."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    targets = properties.get('Targets', [])
+    for target in targets:
+        # Target 'Arn' points to the invoked resource
+        refs_in_target_arn = find_logical_ids(target.get('Arn'), defined_logical_ids, ref_cache)
+        for ref_id in refs_in_target_arn:
+            logger.debug("%s (Event Rule) -> %s", logical_id, ref_id)
+            parsed_relations[logical_id]['invokes'].add(ref_id)
+
+def handle_event_source_mapping(logical_id, cfn_type, properties, context):
+    """Lambda Event Source Mappings: the event source invokes the function."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    # Source Arn invokes the FunctionName
+    func_ref = properties.get('FunctionName')
+    source_ref = properties.get('EventSourceArn')
+    func_ids = find_logical_ids(func_ref, defined_logical_ids, ref_cache)
+    source_ids = find_logical_ids(source_ref, defined_logical_ids, ref_cache)
+    if func_ids and source_ids:
+        func_id = next(iter(func_ids))
+        source_id = next(iter(source_ids))
+        logger.debug("%s (Event Source) -> %s", source_id, func_id)
+        # Source invokes the Lambda
+        get_relation_entry(parsed_relations, source_id)['invokes'].add(func_id)
+
+def handle_lambda_permission(logical_id, cfn_type, properties, context):
+    """Lambda Permissions: a known service principal invokes the function."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    # ** NEW LOGIC: Create pseudo-resource for external service **
+    principal = properties.get('Principal')
+    func_ref = properties.get('FunctionName')
+    func_ids = find_logical_ids(func_ref, defined_logical_ids, ref_cache)
+
+    if func_ids and principal in SERVICE_PRINCIPAL_MAP:
+        target_lambda_id = next(iter(func_ids))
+        service_info = SERVICE_PRINCIPAL_MAP[principal]
+        service_id = service_info['id']
+        service_type = service_info['type']
+
+        logger.debug("%s (External Service via Permission) -> %s", service_id, target_lambda_id)
+
+        # Ensure the service pseudo-resource exists in our structure and add the lambda to its invokes list
+        ensure_relation_entry(parsed_relations, service_id, service_type, 'AWS')['invokes'].add(target_lambda_id)
+    elif func_ids:
+        # Handle non-service principals if necessary (e.g., another AWS account)
+        logger.debug("Note: Lambda permission found for principal '%s' targeting '%s'. Handling non-service principals not implemented.", principal, next(iter(func_ids)))
+
+def handle_appsync_data_source(logical_id, cfn_type, properties, context):
+    """AppSync DataSources: the data source invokes its Lambda, table or event bus."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    lambda_conf = properties.get('LambdaConfig') or {}
+    ddb_conf = properties.get('DynamoDBConfig') or {}
+    # DataSource invokes underlying Lambda or DynamoDB table
+    refs_in_ds = find_logical_ids(lambda_conf.get('LambdaFunctionArn'), defined_logical_ids, ref_cache)
+    collect_logical_ids(ddb_conf.get('TableName'), defined_logical_ids, refs_in_ds, ref_cache)
+    # Add other DataSource types (HTTP, Relational DB, etc.)
+    for ref_id in refs_in_ds:
+        logger.debug("%s (AppSync DS) -> %s", logical_id, ref_id)
+        parsed_relations[logical_id]['invokes'].add(ref_id)
+
+    # --- NEW: Handle other AppSync DataSource Types ---
+    http_config = properties.get('HttpConfig')
+    event_bridge_config = properties.get('EventBridgeConfig')
+    # Add others like RelationalDatabaseConfig, ElasticsearchConfig etc. if needed
+
+    if isinstance(http_config, dict) and http_config.get('Endpoint'):
+         # DataSource invokes an HTTP endpoint
+         http_endpoint = http_config['Endpoint']
+         logger.debug("%s (AppSync DS) -> %s (HTTP Endpoint)", logical_id, http_endpoint)
+         # Not adding to invokes list as it's not a defined CFN resource
+         # Could add a special representation if needed
+
+    if isinstance(event_bridge_config, dict) and event_bridge_config.get('EventBusArn'):
+         # DataSource invokes EventBridge
+         eb_bus_arn_ref = event_bridge_config['EventBusArn']
+         eb_ids = find_logical_ids(eb_bus_arn_ref, defined_logical_ids, ref_cache)
+         if eb_ids:
+              eb_logical_id = next(iter(eb_ids))
+              logger.debug("%s (AppSync DS) -> %s (EventBridge Bus)", logical_id, eb_logical_id)
+              parsed_relations[logical_id]['invokes'].add(eb_logical_id)
+         else:
+              logger.debug("Info: AppSync DS %s targets external/ARN EventBus: %s", logical_id, eb_bus_arn_ref)
+
+def handle_appsync_resolver(logical_id, cfn_type, properties, context):
+    """AppSync Resolvers: the resolver invokes its data source."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    # Resolver invokes its DataSource
+    ds_name = properties.get('DataSourceName') # This is usually the *name* property of the DS
+    # Find the DataSource resource by its Name property
+    ds_logical_id = context['appsync_ds_by_name'].get(ds_name) if isinstance(ds_name, str) else None
+    if ds_logical_id:
+        logger.debug("%s (AppSync Resolver) -> %s", logical_id, ds_logical_id)
+        parsed_relations[logical_id]['invokes'].add(ds_logical_id)
+    else:
+        # Could also be a Ref to the logical ID
+        ds_ids = find_logical_ids(ds_name, defined_logical_ids, ref_cache)
+        if ds_ids:
+             ds_logical_id = next(iter(ds_ids))
+             logger.debug("%s (AppSync Resolver Ref) -> %s", logical_id, ds_logical_id)
+             parsed_relations[logical_id]['invokes'].add(ds_logical_id)
+        else:
+             logger.warning("Warning: Could not find DataSource '%s' for Resolver '%s'", ds_name, logical_id)
+
+def handle_custom_resource(logical_id, cfn_type, properties, context):
+    """CloudFormation Custom Resources: the resource invokes its ServiceToken target."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    service_token_ref = properties.get('ServiceToken')
+    token_ids = find_logical_ids(service_token_ref, defined_logical_ids, ref_cache)
+    if token_ids:
+         # Custom Resource invokes the Lambda/SNS specified in ServiceToken
+         token_logical_id = next(iter(token_ids))
+         logger.debug("%s (Custom Resource) -> %s", logical_id, token_logical_id)
+         parsed_relations[logical_id]['invokes'].add(token_logical_id)
+    elif service_token_ref:
+         logger.warning("Warning: Could not resolve ServiceToken '%s' for Custom Resource '%s'.", service_token_ref, logical_id)
+
+def handle_api_gateway_authorizer(logical_id, cfn_type, properties, context):
+    """API Gateway Authorizers: the RestApi invokes the authorizer Lambda."""
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    # Authorizer is invoked by the API Gateway it's attached to
+    rest_api_ref = properties.get('RestApiId')
+    authorizer_uri_ref = properties.get('AuthorizerUri') # Lambda URI
+
+    api_ids = find_logical_ids(rest_api_ref, defined_logical_ids, ref_cache)
+    # AuthorizerUri format: arn:aws:apigateway:{region}:lambda:path/2015-03-31/functions/{lambda_arn}/invocations
+    # We need to extract the lambda ARN/Ref from the URI string or object
+    lambda_ids = set()
+    if isinstance(authorizer_uri_ref, str):
+         # Try simple find_logical_ids first if URI itself contains a ref
+         collect_logical_ids(authorizer_uri_ref, defined_logical_ids, lambda_ids, ref_cache)
+         # Basic regex to extract potential Lambda ref from standard URI path
+         match = AUTHORIZER_URI_PATTERN.search(authorizer_uri_ref)
+         if match:
+             lambda_name_or_ref = match.group(1)
+             # Check if the extracted name is a logical ID
+             if lambda_name_or_ref in defined_logical_ids:
+                 lambda_ids.add(lambda_name_or_ref)
+             else:
+                # Try find_logical_ids on the extracted part too
+                 collect_logical_ids(lambda_name_or_ref, defined_logical_ids, lambda_ids, ref_cache)
+    elif isinstance(authorizer_uri_ref, dict):
+         # Handle cases like !Sub in AuthorizerUri
+         collect_logical_ids(authorizer_uri_ref, defined_logical_ids, lambda_ids, ref_cache)
+
+
+    if api_ids and lambda_ids:
+         api_logical_id = next(iter(api_ids))
+         lambda_logical_id = next(iter(lambda_ids))
+         # API Gateway invokes the Authorizer Lambda
+         logger.debug("%s (API Gateway via Authorizer %s) -> %s", api_logical_id, logical_id, lambda_logical_id)
+         # The RestApi is a defined resource, so its entry already exists regardless of template order
+         parsed_relations[api_logical_id]['invokes'].add(lambda_logical_id)
+    elif rest_api_ref and authorizer_uri_ref:
+         logger.warning("Warning: Could not fully resolve RestApiId (%s) or Lambda from AuthorizerUri (%s) for Authorizer '%s'.", rest_api_ref, authorizer_uri_ref, logical_id)
+
+def handle_cloudfront_distribution(logical_id, cfn_type, properties, context):
+    """CloudFront Distributions: the distribution invokes its Lambda@Edge functions."""
+    resources = context['resources']
+    defined_logical_ids = context['defined_logical_ids']
+    parsed_relations = context['parsed_relations']
+    ref_cache = context['ref_cache']
+
+    dist_config = properties.get('DistributionConfig') or {}
+    # Check the default cache behavior and the other cache behaviors, without collecting into a list first
+    cache_behaviors = chain((dist_config.get('DefaultCacheBehavior') or {},), dist_config.get('CacheBehaviors', []))
+    lambda_associations = chain.from_iterable(
+        behavior.get('LambdaFunctionAssociations', []) for behavior in cache_behaviors
+    )
+
+    invoked_lambda_ids = set()
+    for assoc in lambda_associations:
+         lambda_arn_with_version = assoc.get('LambdaFunctionARN')
+         if isinstance(lambda_arn_with_version, str):
+             # Attempt to remove potential version suffix
+             base_lambda_arn = lambda_arn_with_version.rsplit(':', 1)[0] # Remove potential version/alias
+             # Try resolving the base ARN
+             lambda_ids = find_logical_ids(base_lambda_arn, defined_logical_ids, ref_cache)
+             if not lambda_ids:
+                 # Also try resolving the original ARN in case it was a direct !Ref without version
+                  lambda_ids = find_logical_ids(lambda_arn_with_version, defined_logical_ids, ref_cache)
+             invoked_lambda_ids.update(lambda_ids)
+         elif isinstance(lambda_arn_with_version, dict): # Handle !Ref, !GetAtt
+             # find_logical_ids should handle resolving refs/getatts
+             collect_logical_ids(lambda_arn_with_version, defined_logical_ids, invoked_lambda_ids, ref_cache)
+
+    for lambda_id in invoked_lambda_ids:
+         if lambda_id in resources:
+             # CloudFront distribution invokes the Lambda@Edge function
+             logger.debug("%s (CloudFront Distribution) -> %s (Lambda@Edge)", logical_id, lambda_id)
+             parsed_relations[logical_id]['invokes'].add(lambda_id)
+         else:
+              logger.warning("Warning: Lambda@Edge function '%s' for CloudFront Distribution '%s' not found in this template.", lambda_id, logical_id)
+
+RESOURCE_HANDLERS = {
+    "AWS::Lambda::Function": handle_lambda_function,
+    "AWS::Serverless::Function": handle_lambda_function,
+    "AWS::ApiGateway::Method": handle_api_gateway_method,
+    "AWS::StepFunctions::StateMachine": handle_state_machine,
+    "AWS::S3::Bucket": handle_s3_bucket,
+    "AWS::SNS::Subscription": handle_sns_subscription,
+    "AWS::Events::Rule": handle_events_rule,
+    "AWS::Lambda::EventSourceMapping": handle_event_source_mapping,
+    "AWS::Lambda::Permission": handle_lambda_permission,
+    "AWS::AppSync::DataSource": handle_appsync_data_source,
+    "AWS::AppSync::Resolver": handle_appsync_resolver,
+    "AWS::CloudFormation::CustomResource": handle_custom_resource,
+    "AWS::ApiGateway::Authorizer": handle_api_gateway_authorizer,
+    "AWS::CloudFront::Distribution": handle_cloudfront_distribution,
+}
+RESOURCE_HANDLERS = {sys.intern(k): v for k, v in RESOURCE_HANDLERS.items()}
+# --- Resource Type Handlers --- END
+
 def parse_cloudformation(template_path, account_name):
     """Parses a CFN template and generates the resource relations structure (invokes only)."""
     try:
-        with open(template_path, 'r') as f:
-            template = yaml.safe_load(f)
+        template = None
+        if orjson is not None and template_path.lower().endswith('.json'):
+            # JSON templates need none of the YAML tag handling, and orjson parses them far faster
+            with open(template_path, 'rb') as f:
+                try:
+                    template = orjson.loads(f.read())
+                except orjson.JSONDecodeError:
+                    pass # Not strict JSON (e.g. comments); leave it to the YAML loader
+        if template is None:
+            # Hand libyaml the raw bytes; it detects the encoding itself, so Python needn't decode first
+            with open(template_path, 'rb') as f:
+                template = yaml.load(f, Loader=CfnLoader)
     except FileNotFoundError:
         print(f"Error: Template file not found at '{template_path}'", file=sys.stderr)
         return None
@@ -150,600 +848,102 @@ def parse_cloudformation(template_path, account_name):
         print("Error: Template does not contain a 'Resources' section.", file=sys.stderr)
         return None
 
-    resources = template['Resources']
+    # Intern logical IDs and types once: they are used as dict keys and compared throughout the parse
+    resources = {}
+    for res_id, res_data in template['Resources'].items():
+        if isinstance(res_data, dict) and isinstance(res_data.get('Type'), str):
+            res_data['Type'] = sys.intern(res_data['Type'])
+        resources[sys.intern(res_id) if isinstance(res_id, str) else res_id] = res_data
     defined_logical_ids = set(resources.keys())
+    # Memoized find_logical_ids results for this template, keyed by node id
+    ref_cache = {}
+    # Index resource types and IAM Role properties once instead of re-reading them per lookup
+    type_by_id = {res_id: res_data.get('Type') for res_id, res_data in resources.items()}
+    role_props_by_id = {
+        res_id: res_data.get('Properties') or {}
+        for res_id, res_data in resources.items()
+        if type_by_id[res_id] == "AWS::IAM::Role"
+    }
+    # Explicit Arn properties used to resolve Fn::Sub placeholders in Step Function definitions (basic ARN guess)
+    arn_by_id = {
+        res_id: res_data['Properties']['Arn']
+        for res_id, res_data in resources.items()
+        if isinstance(res_data.get('Properties'), dict) and 'Arn' in res_data['Properties']
+    }
+    # AppSync DataSources by their Name property (first one wins), so Resolvers don't scan every resource
+    appsync_ds_by_name = {}
+    for res_id, res_data in resources.items():
+        if type_by_id[res_id] == "AWS::AppSync::DataSource":
+            ds_name = (res_data.get('Properties') or {}).get('Name')
+            if isinstance(ds_name, str):
+                appsync_ds_by_name.setdefault(ds_name, res_id)
     # Initialize structure - REMOVED invoked_by_external
-    parsed_relations = defaultdict(lambda: {"invokes": set()})
+    # Every defined resource gets its entry (with type and account info) up front; pseudo-resources
+    # are added explicitly by the handlers (get_relation_entry/ensure_relation_entry)
+    parsed_relations = {
+        res_id: {"invokes": set(), "_original_type": type_by_id[res_id], "account_name": account_name}
+        for res_id in resources
+    }
+
+    # Per-template state shared with the resource type handlers
+    context = {
+        'resources': resources,
+        'defined_logical_ids': defined_logical_ids,
+        'type_by_id': type_by_id,
+        'role_props_by_id': role_props_by_id,
+        'arn_by_id': arn_by_id,
+        'appsync_ds_by_name': appsync_ds_by_name,
+        'parsed_relations': parsed_relations,
+        'account_name': account_name,
+        'ref_cache': ref_cache,
+        # Role policy scan results, shared by every resource using the same role
+        'role_invoke_cache': {},
+    }
 
     # First pass: Collect basic info and potential relationships
     print("Parsing resources and identifying potential invocations...")
     for logical_id, resource_details in resources.items():
-        cfn_type = resource_details.get('Type')
-        properties = resource_details.get('Properties', {})
-
-        # Store basic type and account info temporarily
-        parsed_relations[logical_id]['_original_type'] = cfn_type
-        parsed_relations[logical_id]['account_name'] = account_name
+        cfn_type = type_by_id[logical_id]
+        properties = resource_details.get('Properties') or {}
 
         # --- Logic to identify 'invokes' relationships based on type ---
-        if cfn_type == "AWS::Lambda::Function" or cfn_type == "AWS::Serverless::Function":
-            # Env vars often mean Lambda -> Target
-            env_vars = properties.get('Environment', {}).get('Variables', {})
-            refs_in_env = find_logical_ids(env_vars, defined_logical_ids)
-            for ref_id in refs_in_env:
-                print(f"  {logical_id} ({cfn_type} Env) -> {ref_id}")
-                parsed_relations[logical_id]['invokes'].add(ref_id)
-
-            # Check Role for lambda:InvokeFunction permissions
-            role_ref = properties.get('Role') # Works for Function and Serverless::Function
-            role_ids = find_logical_ids(role_ref, defined_logical_ids)
-            if role_ids:
-                role_logical_id = list(role_ids)[0] # Assuming one role
-                # Need to check if the Role resource itself exists in the template
-                if role_logical_id in resources and resources[role_logical_id].get('Type') == "AWS::IAM::Role":
-                     role_props = resources[role_logical_id].get('Properties', {})
-                     policies = role_props.get('Policies', [])
-                     # Also check ManagedPolicyArns if applicable (more complex to parse)
-                     # Also check Inline Policies property
-
-                     # Simple check in inline policies
-                     for policy in policies:
-                         statements = policy.get('PolicyDocument', {}).get("Statement", [])
-                         for statement in statements:
-                             action = statement.get('Action', [])
-                             if not isinstance(action, list): action = [action]
-
-                             if statement.get('Effect') == 'Allow' and 'lambda:InvokeFunction' in action:
-                                 policy_resources = statement.get('Resource', [])
-                                 if not isinstance(policy_resources, list): policy_resources = [policy_resources]
-
-                                 # Find logical IDs referenced in the Resource field of the policy
-                                 refs_in_policy_res = find_logical_ids(policy_resources, defined_logical_ids)
-
-                                 for target_lambda_id in refs_in_policy_res:
-                                     # Ensure the target is actually a Lambda defined in the template
-                                     target_type = resources.get(target_lambda_id, {}).get('Type')
-                                     if target_lambda_id in resources and target_type in ["AWS::Lambda::Function", "AWS::Serverless::Function"]:
-                                         print(f"  {logical_id} ({cfn_type} via Role Invoke) -> {target_lambda_id}")
-                                         parsed_relations[logical_id]['invokes'].add(target_lambda_id)
-
-            # Handle SAM 'Events' shorthand for Serverless::Function
-            if cfn_type == "AWS::Serverless::Function":
-                events = properties.get('Events', {})
-                for event_name, event_details in events.items():
-                    event_type = event_details.get('Type')
-                    event_props = event_details.get('Properties', {})
-
-                    # Example for SQS Event
-                    if event_type == 'SQS':
-                        queue_ref = event_props.get('Queue')
-                        queue_ids = find_logical_ids(queue_ref, defined_logical_ids)
-                        if queue_ids:
-                            queue_logical_id = list(queue_ids)[0]
-                            # Queue invokes this Lambda
-                            print(f"  {queue_logical_id} (SQS Event Source for SAM) -> {logical_id}")
-                            parsed_relations[queue_logical_id]['invokes'].add(logical_id)
-                        else:
-                            print(f"  Warning: Could not resolve SQS Queue reference '{queue_ref}' for SAM Function '{logical_id}' event '{event_name}'.")
-                    # Add handlers for other SAM Event types (API, Schedule, S3, etc.) here
-                    # Example for API Event (more complex, involves implicit API GW resources)
-                    elif event_type == 'Api':
-                         # This implies an API Gateway invokes this function.
-                         # We might need to create a pseudo API GW resource or link to an existing one.
-                         # For simplicity, we could use a generic 'APIGateway' pseudo-resource if not explicitly defined.
-                         api_gw_pseudo_id = 'APIGateway' # Default pseudo-ID
-                         rest_api_id_ref = event_props.get('RestApiId') # Check if linked to specific API
-                         if rest_api_id_ref:
-                             resolved_api_ids = find_logical_ids(rest_api_id_ref, defined_logical_ids)
-                             if resolved_api_ids:
-                                 api_gw_pseudo_id = list(resolved_api_ids)[0] # Use the actual logical ID
-
-                         print(f"  {api_gw_pseudo_id} (API Event Source for SAM) -> {logical_id}")
-                         # Ensure the API GW resource exists in our structure
-                         if api_gw_pseudo_id not in parsed_relations:
-                             parsed_relations[api_gw_pseudo_id]['_original_type'] = 'AWS::ApiGateway::RestApi' # Assume type
-                             parsed_relations[api_gw_pseudo_id]['account_name'] = account_name
-                             parsed_relations[api_gw_pseudo_id]['invokes'] = set() # Initialize invokes
-                         parsed_relations[api_gw_pseudo_id]['invokes'].add(logical_id)
-                    # --- NEW: Handle other SAM Event Types ---
-                    elif event_type == 'S3':
-                        bucket_ref = event_props.get('Bucket')
-                        if bucket_ref:
-                             # S3 Bucket Event invokes this Lambda
-                             s3_service_id = 'S3' # Use pseudo-resource ID
-                             s3_service_type = 'AWS::Service::S3'
-                             print(f"  {s3_service_id} (S3 Event Source for SAM via Bucket Ref: {bucket_ref}) -> {logical_id}")
-                             # Ensure S3 pseudo-resource exists
-                             if s3_service_id not in parsed_relations:
-                                parsed_relations[s3_service_id]['_original_type'] = s3_service_type
-                                parsed_relations[s3_service_id]['account_name'] = 'AWS'
-                                parsed_relations[s3_service_id]['invokes'] = set()
-                             parsed_relations[s3_service_id]['invokes'].add(logical_id)
-                        else:
-                             print(f"  Warning: SAM S3 Event for '{logical_id}' missing Bucket property.")
-
-                    elif event_type == 'SNS':
-                        topic_ref = event_props.get('Topic')
-                        topic_ids = find_logical_ids(topic_ref, defined_logical_ids)
-                        if topic_ids:
-                            topic_logical_id = list(topic_ids)[0]
-                            # SNS Topic invokes this Lambda
-                            print(f"  {topic_logical_id} (SNS Event Source for SAM) -> {logical_id}")
-                            parsed_relations[topic_logical_id]['invokes'].add(logical_id)
-                        else:
-                            print(f"  Warning: Could not resolve SNS Topic reference '{topic_ref}' for SAM Function '{logical_id}' event '{event_name}'.")
-
-                    elif event_type == 'DynamoDB':
-                        stream_ref = event_props.get('Stream')
-                        # Stream ARN is usually !GetAtt Table.StreamArn
-                        # We need to resolve the Table ID from this
-                        table_ids = set()
-                        if isinstance(stream_ref, dict) and 'Fn::GetAtt' in stream_ref:
-                            getatt_list = stream_ref['Fn::GetAtt']
-                            if isinstance(getatt_list, list) and len(getatt_list) > 0 and getatt_list[0] in defined_logical_ids:
-                                table_ids.add(getatt_list[0])
-                        elif isinstance(stream_ref, str):
-                             # Less common, maybe direct ARN reference - try to find base ID
-                             table_ids.update(find_logical_ids(stream_ref, defined_logical_ids))
-
-                        if table_ids:
-                            table_logical_id = list(table_ids)[0]
-                             # DynamoDB Table Stream invokes this Lambda
-                            print(f"  {table_logical_id} (DynamoDB Event Source for SAM) -> {logical_id}")
-                            parsed_relations[table_logical_id]['invokes'].add(logical_id)
-                        else:
-                            print(f"  Warning: Could not resolve DynamoDB Table from Stream '{stream_ref}' for SAM Function '{logical_id}' event '{event_name}'.")
-
-                    elif event_type == 'Schedule':
-                         # EventBridge Schedule invokes this Lambda
-                         eb_service_id = 'EventBridge' # Use pseudo-resource ID
-                         eb_service_type = 'AWS::Service::EventBridge'
-                         # Schedule name/ARN might be in event_props.Schedule, but not always a defined resource
-                         print(f"  {eb_service_id} (Schedule Event Source for SAM) -> {logical_id}")
-                         # Ensure EventBridge pseudo-resource exists
-                         if eb_service_id not in parsed_relations:
-                            parsed_relations[eb_service_id]['_original_type'] = eb_service_type
-                            parsed_relations[eb_service_id]['account_name'] = 'AWS'
-                            parsed_relations[eb_service_id]['invokes'] = set()
-                         parsed_relations[eb_service_id]['invokes'].add(logical_id)
-
-            # --- NEW: Handle Lambda Dead Letter Queue (DLQ) ---
-            dlq_config = properties.get('DeadLetterConfig')
-            if isinstance(dlq_config, dict):
-                 target_arn_ref = dlq_config.get('TargetArn')
-                 dlq_ids = find_logical_ids(target_arn_ref, defined_logical_ids)
-                 if dlq_ids:
-                     dlq_logical_id = list(dlq_ids)[0]
-                     # Lambda sends failed events to the DLQ (SQS or SNS)
-                     print(f"  {logical_id} (Lambda DLQ) -> {dlq_logical_id}")
-                     parsed_relations[logical_id]['invokes'].add(dlq_logical_id)
-                 elif target_arn_ref:
-                     print(f"  Warning: Could not resolve DLQ TargetArn '{target_arn_ref}' for Lambda '{logical_id}'.")
-
-        elif cfn_type == "AWS::ApiGateway::Method":
-            integration = properties.get('Integration', {})
-            refs_in_uri = find_logical_ids(integration.get('Uri'), defined_logical_ids)
-            for ref_id in refs_in_uri:
-                # Method invokes target (usually Lambda)
-                print(f"  {logical_id} (API Method) -> {ref_id}")
-                parsed_relations[logical_id]['invokes'].add(ref_id)
-                # Also infer parent RestApi invokes target
-                api_ref = properties.get('RestApiId')
-                api_ids = find_logical_ids(api_ref, defined_logical_ids)
-                if api_ids:
-                    api_logical_id = list(api_ids)[0]
-                    print(f"  {api_logical_id} (API Gateway) -> {ref_id}")
-                    # Ensure API Gateway exists and add invoke
-                    if api_logical_id not in parsed_relations: # Should exist if defined
-                         parsed_relations[api_logical_id]['_original_type'] = 'AWS::ApiGateway::RestApi'
-                         parsed_relations[api_logical_id]['account_name'] = account_name
-                         parsed_relations[api_logical_id]['invokes'] = set()
-                    parsed_relations[api_logical_id]['invokes'].add(ref_id)
-
-        elif cfn_type == "AWS::StepFunctions::StateMachine":
-            # Check RoleArn for permissions to invoke other resources
-            role_ref = properties.get('RoleArn')
-            role_ids = find_logical_ids(role_ref, defined_logical_ids)
-            if role_ids:
-                role_logical_id = list(role_ids)[0]
-                if role_logical_id in resources and resources[role_logical_id].get('Type') == "AWS::IAM::Role":
-                     role_props = resources[role_logical_id].get('Properties', {})
-                     # Check inline policies
-                     policies = role_props.get('Policies', [])
-                     for policy in policies:
-                          statements = policy.get('PolicyDocument', {}).get("Statement", [])
-                          for statement in statements:
-                              action = statement.get('Action', [])
-                              if not isinstance(action, list): action = [action]
-                              # Check for lambda:InvokeFunction, states:StartExecution, etc.
-                              if statement.get('Effect') == 'Allow' and ('lambda:InvokeFunction' in action or 'states:StartExecution' in action):
-                                  policy_resources = statement.get('Resource', [])
-                                  if not isinstance(policy_resources, list): policy_resources = [policy_resources]
-                                  refs_in_policy_res = find_logical_ids(policy_resources, defined_logical_ids)
-                                  for target_id in refs_in_policy_res:
-                                      if target_id in resources: # Ensure target is defined here
-                                           print(f"  {logical_id} (Step Function via Role) -> {target_id}")
-                                           parsed_relations[logical_id]['invokes'].add(target_id)
-            # TODO: Parse DefinitionString/Definition for Task states invoking Lambdas/other SFNs
-            # --- NEW: Parse State Machine Definition ---
-            definition = properties.get('Definition')
-            definition_string = properties.get('DefinitionString')
-
-            sfn_definition_json = None
-            if isinstance(definition, dict): # Definition is already JSON/dict
-                sfn_definition_json = definition
-            elif isinstance(definition_string, str): # DefinitionString needs parsing
-                try:
-                    # Handle potential !Sub in DefinitionString
-                    if 'Fn::Sub' in definition_string:
-                        sub_input = definition_string['Fn::Sub']
-                        sub_string_template = sub_input if isinstance(sub_input, str) else sub_input[0]
-                        # Very basic substitution - assumes ${LogicalId} or ${LogicalId.Arn}
-                        # A more robust solution would need context of Sub variables if provided
-                        def replace_sub(match):
-                            ref_id = match.group(1)
-                            # Attempt to resolve - this is tricky without full context
-                            # For now, just return the ID, find_logical_ids will catch it later if it's simple
-                            return resources.get(ref_id, {}).get('Properties', {}).get('Arn', ref_id) # Basic ARN guess
-                        
-                        processed_string = re.sub(r'\${([a-zA-Z0-9]+)(?:\.Arn)?}', replace_sub, sub_string_template)
-                        sfn_definition_json = json.loads(processed_string)
-                    else:
-                        sfn_definition_json = json.loads(definition_string)
-                except json.JSONDecodeError as e:
-                    print(f"  Warning: Could not parse JSON in DefinitionString for {logical_id}: {e}", file=sys.stderr)
-                except Exception as e:
-                    print(f"  Warning: Error processing DefinitionString for {logical_id}: {e}", file=sys.stderr)
-            elif isinstance(definition_string, dict) and 'Fn::Sub' in definition_string:
-                 # Handle cases where DefinitionString is itself an Fn::Sub object
-                 try:
-                    sub_input = definition_string['Fn::Sub']
-                    sub_string_template = sub_input if isinstance(sub_input, str) else sub_input[0]
-                    # Basic substitution again
-                    def replace_sub(match):
-                        ref_id = match.group(1)
-                        return resources.get(ref_id, {}).get('Properties', {}).get('Arn', ref_id)
-                    processed_string = re.sub(r'\${([a-zA-Z0-9]+)(?:\.Arn)?}', replace_sub, sub_string_template)
-                    sfn_definition_json = json.loads(processed_string)
-                 except Exception as e:
-                    print(f"  Warning: Error processing Fn::Sub DefinitionString for {logical_id}: {e}", file=sys.stderr)
-
-
-            if sfn_definition_json and 'States' in sfn_definition_json:
-                states = sfn_definition_json['States']
-                # Recursive function to find Task resources
-                def find_task_refs(current_states):
-                    refs = set()
-                    for state_name, state_data in current_states.items():
-                        if state_data.get('Type') == 'Task':
-                            resource_arn = state_data.get('Resource')
-                            parameters = state_data.get('Parameters')
-                            # Check resource ARN string
-                            if isinstance(resource_arn, str):
-                                refs.update(find_logical_ids(resource_arn, defined_logical_ids))
-                            # Check parameters for relevant ARNs/Refs
-                            if isinstance(parameters, dict):
-                                for param_key, param_value in parameters.items():
-                                     # Look for common keys pointing to other resources
-                                     if param_key in ['FunctionName', 'StateMachineArn', 'QueueUrl', 'TopicArn']:
-                                         refs.update(find_logical_ids(param_value, defined_logical_ids))
-                                     # Also just generally search the value itself
-                                     else:
-                                          refs.update(find_logical_ids(param_value, defined_logical_ids))
-
-                        # Recurse into Map and Parallel states
-                        if state_data.get('Type') == 'Map' and 'Iterator' in state_data and 'States' in state_data['Iterator']:
-                             refs.update(find_task_refs(state_data['Iterator']['States']))
-                        if state_data.get('Type') == 'Parallel' and 'Branches' in state_data:
-                             for branch in state_data['Branches']:
-                                 if 'States' in branch:
-                                     refs.update(find_task_refs(branch['States']))
-                    return refs
-
-                task_invoked_ids = find_task_refs(states)
-                for target_id in task_invoked_ids:
-                    # Check if it's a resource defined in this template
-                    if target_id in resources:
-                         print(f"  {logical_id} (Step Function Definition) -> {target_id}")
-                         parsed_relations[logical_id]['invokes'].add(target_id)
-                    else:
-                         # Might be a direct ARN or resource in another stack
-                         print(f"  Info: Step Function {logical_id} definition references external/ARN: {target_id}")
-                         # Optionally add as Unknown/External if desired, but sticking to known resources for now
-
-        # --- NEW: Handle S3 Bucket Notifications ---
-        elif cfn_type == "AWS::S3::Bucket":
-            notification_config = properties.get('NotificationConfiguration')
-            if isinstance(notification_config, dict):
-                # Define service ID for S3
-                s3_service_id = 'S3' # Consistent with Lambda:Permission handling
-                s3_service_type = 'AWS::Service::S3'
-
-                targets_found = False
-                invoked_targets = set()
-
-                # Check Lambda configurations
-                for config in notification_config.get('LambdaConfigurations', []):
-                    func_arn = config.get('Function')
-                    if func_arn:
-                        invoked_targets.update(find_logical_ids(func_arn, defined_logical_ids))
-                        targets_found = True
-
-                # Check SQS configurations
-                for config in notification_config.get('QueueConfigurations', []):
-                    queue_arn = config.get('Queue')
-                    if queue_arn:
-                        invoked_targets.update(find_logical_ids(queue_arn, defined_logical_ids))
-                        targets_found = True
-
-                # Check SNS configurations
-                for config in notification_config.get('TopicConfigurations', []):
-                    topic_arn = config.get('Topic')
-                    if topic_arn:
-                        invoked_targets.update(find_logical_ids(topic_arn, defined_logical_ids))
-                        targets_found = True
-
-                # If any targets found, ensure S3 pseudo-resource exists and add invokes
-                if targets_found:
-                    if s3_service_id not in parsed_relations:
-                        parsed_relations[s3_service_id]['_original_type'] = s3_service_type
-                        parsed_relations[s3_service_id]['account_name'] = 'AWS'
-                        parsed_relations[s3_service_id]['invokes'] = set()
-                    
-                    for target_id in invoked_targets:
-                         if target_id in resources:
-                            print(f"  {s3_service_id} (S3 Notification via Bucket {logical_id}) -> {target_id}")
-                            parsed_relations[s3_service_id]['invokes'].add(target_id)
-                         else:
-                            print(f"  Info: S3 Bucket {logical_id} notification references external/ARN: {target_id}")
-
-        # --- NEW: Handle explicit SNS Subscriptions ---
-        elif cfn_type == "AWS::SNS::Subscription":
-            topic_arn_ref = properties.get('TopicArn')
-            endpoint_ref = properties.get('Endpoint') # Can be Lambda ARN, SQS ARN, etc.
-            protocol = properties.get('Protocol') # e.g., 'lambda', 'sqs'
-
-            if topic_arn_ref and endpoint_ref and protocol in ['lambda', 'sqs']: # Focus on Lambda/SQS for now
-                topic_ids = find_logical_ids(topic_arn_ref, defined_logical_ids)
-                endpoint_ids = find_logical_ids(endpoint_ref, defined_logical_ids)
-
-                if topic_ids and endpoint_ids:
-                    topic_logical_id = list(topic_ids)[0]
-                    endpoint_logical_id = list(endpoint_ids)[0]
-
-                    # Ensure the referenced Topic exists in our parsed relations
-                    if topic_logical_id in parsed_relations:
-                        print(f"  {topic_logical_id} (SNS Topic via Subscription) -> {endpoint_logical_id}")
-                        parsed_relations[topic_logical_id]['invokes'].add(endpoint_logical_id)
-                    else:
-                        print(f"  Warning: Topic '{topic_logical_id}' referenced in Subscription '{logical_id}' not found in this template.")
-                else:
-                     print(f"  Warning: Could not resolve TopicArn ({topic_arn_ref}) or Endpoint ({endpoint_ref}) for Subscription '{logical_id}'.")
-
-
-        elif cfn_type == "AWS::Events::Rule":
-            targets = properties.get('Targets', [])
-            for target in targets:
-                # Target 'Arn' points to the invoked resource
-                refs_in_target_arn = find_logical_ids(target.get('Arn'), defined_logical_ids)
-                for ref_id in refs_in_target_arn:
-                    print(f"  {logical_id} (Event Rule) -> {ref_id}")
-                    parsed_relations[logical_id]['invokes'].add(ref_id)
-
-        elif cfn_type == "AWS::Lambda::EventSourceMapping":
-            # Source Arn invokes the FunctionName
-            func_ref = properties.get('FunctionName')
-            source_ref = properties.get('EventSourceArn')
-            func_ids = find_logical_ids(func_ref, defined_logical_ids)
-            source_ids = find_logical_ids(source_ref, defined_logical_ids)
-            if func_ids and source_ids:
-                func_id = list(func_ids)[0]
-                source_id = list(source_ids)[0]
-                print(f"  {source_id} (Event Source) -> {func_id}")
-                # Source invokes the Lambda
-                parsed_relations[source_id]['invokes'].add(func_id)
-
-        elif cfn_type == "AWS::Lambda::Permission":
-            # ** NEW LOGIC: Create pseudo-resource for external service **
-            principal = properties.get('Principal')
-            func_ref = properties.get('FunctionName')
-            func_ids = find_logical_ids(func_ref, defined_logical_ids)
-
-            if func_ids and principal in SERVICE_PRINCIPAL_MAP:
-                target_lambda_id = list(func_ids)[0]
-                service_info = SERVICE_PRINCIPAL_MAP[principal]
-                service_id = service_info['id']
-                service_type = service_info['type']
-
-                print(f"  {service_id} (External Service via Permission) -> {target_lambda_id}")
-
-                # Ensure the service pseudo-resource exists in our structure
-                if service_id not in parsed_relations:
-                    parsed_relations[service_id]['_original_type'] = service_type
-                    parsed_relations[service_id]['account_name'] = 'AWS' # Mark as AWS service account
-                    parsed_relations[service_id]['invokes'] = set() # Initialize invokes
-
-                # Add the lambda to the service's invokes list
-                parsed_relations[service_id]['invokes'].add(target_lambda_id)
-            elif func_ids:
-                # Handle non-service principals if necessary (e.g., another AWS account)
-                print(f"  Note: Lambda permission found for principal '{principal}' targeting '{list(func_ids)[0]}'. Handling non-service principals not implemented.")
-
-
-        elif cfn_type == "AWS::AppSync::DataSource":
-            lambda_conf = properties.get('LambdaConfig', {})
-            ddb_conf = properties.get('DynamoDBConfig', {})
-            # DataSource invokes underlying Lambda or DynamoDB table
-            refs_in_ds = find_logical_ids(lambda_conf.get('LambdaFunctionArn'), defined_logical_ids)
-            refs_in_ds.update(find_logical_ids(ddb_conf.get('TableName'), defined_logical_ids))
-            # Add other DataSource types (HTTP, Relational DB, etc.)
-            for ref_id in refs_in_ds:
-                print(f"  {logical_id} (AppSync DS) -> {ref_id}")
-                parsed_relations[logical_id]['invokes'].add(ref_id)
-
-            # --- NEW: Handle other AppSync DataSource Types ---
-            http_config = properties.get('HttpConfig')
-            event_bridge_config = properties.get('EventBridgeConfig')
-            # Add others like RelationalDatabaseConfig, ElasticsearchConfig etc. if needed
-
-            if isinstance(http_config, dict) and http_config.get('Endpoint'):
-                 # DataSource invokes an HTTP endpoint
-                 http_endpoint = http_config['Endpoint']
-                 print(f"  {logical_id} (AppSync DS) -> {http_endpoint} (HTTP Endpoint)")
-                 # Not adding to invokes list as it's not a defined CFN resource
-                 # Could add a special representation if needed
-
-            if isinstance(event_bridge_config, dict) and event_bridge_config.get('EventBusArn'):
-                 # DataSource invokes EventBridge
-                 eb_bus_arn_ref = event_bridge_config['EventBusArn']
-                 eb_ids = find_logical_ids(eb_bus_arn_ref, defined_logical_ids)
-                 if eb_ids:
-                      eb_logical_id = list(eb_ids)[0]
-                      print(f"  {logical_id} (AppSync DS) -> {eb_logical_id} (EventBridge Bus)")
-                      parsed_relations[logical_id]['invokes'].add(eb_logical_id)
-                 else:
-                      print(f"  Info: AppSync DS {logical_id} targets external/ARN EventBus: {eb_bus_arn_ref}")
-
-
-        elif cfn_type == "AWS::AppSync::Resolver":
-             # Resolver invokes its DataSource
-             ds_name = properties.get('DataSourceName') # This is usually the *name* property of the DS
-             ds_logical_id = None
-             # Find the DataSource resource by its Name property
-             for res_id, res_data in resources.items():
-                 if res_data.get('Type') == "AWS::AppSync::DataSource" and res_data.get('Properties', {}).get('Name') == ds_name:
-                     ds_logical_id = res_id
-                     break
-             if ds_logical_id:
-                 print(f"  {logical_id} (AppSync Resolver) -> {ds_logical_id}")
-                 parsed_relations[logical_id]['invokes'].add(ds_logical_id)
-             else:
-                 # Could also be a Ref to the logical ID
-                 ds_ids = find_logical_ids(ds_name, defined_logical_ids)
-                 if ds_ids:
-                      ds_logical_id = list(ds_ids)[0]
-                      print(f"  {logical_id} (AppSync Resolver Ref) -> {ds_logical_id}")
-                      parsed_relations[logical_id]['invokes'].add(ds_logical_id)
-                 else:
-                      print(f"  Warning: Could not find DataSource '{ds_name}' for Resolver '{logical_id}'")
-
-        # --- NEW: Handle CloudFormation Custom Resource ---
-        elif cfn_type == "AWS::CloudFormation::CustomResource":
-            service_token_ref = properties.get('ServiceToken')
-            token_ids = find_logical_ids(service_token_ref, defined_logical_ids)
-            if token_ids:
-                 # Custom Resource invokes the Lambda/SNS specified in ServiceToken
-                 token_logical_id = list(token_ids)[0]
-                 print(f"  {logical_id} (Custom Resource) -> {token_logical_id}")
-                 parsed_relations[logical_id]['invokes'].add(token_logical_id)
-            elif service_token_ref:
-                 print(f"  Warning: Could not resolve ServiceToken '{service_token_ref}' for Custom Resource '{logical_id}'.")
-
-        # --- NEW: Handle API Gateway Authorizer ---
-        elif cfn_type == "AWS::ApiGateway::Authorizer":
-            # Authorizer is invoked by the API Gateway it's attached to
-            rest_api_ref = properties.get('RestApiId')
-            authorizer_uri_ref = properties.get('AuthorizerUri') # Lambda URI
-
-            api_ids = find_logical_ids(rest_api_ref, defined_logical_ids)
-            # AuthorizerUri format: arn:aws:apigateway:{region}:lambda:path/2015-03-31/functions/{lambda_arn}/invocations
-            # We need to extract the lambda ARN/Ref from the URI string or object
-            lambda_ids = set()
-            if isinstance(authorizer_uri_ref, str):
-                 # Try simple find_logical_ids first if URI itself contains a ref
-                 lambda_ids.update(find_logical_ids(authorizer_uri_ref, defined_logical_ids))
-                 # Basic regex to extract potential Lambda ref from standard URI path
-                 match = re.search(r'functions/arn:aws:lambda:[^:]+:[^:]+:function:([^/]+)/invocations', authorizer_uri_ref)
-                 if match:
-                     lambda_name_or_ref = match.group(1)
-                     # Check if the extracted name is a logical ID
-                     if lambda_name_or_ref in defined_logical_ids:
-                         lambda_ids.add(lambda_name_or_ref)
-                     else:
-                        # Try find_logical_ids on the extracted part too
-                         lambda_ids.update(find_logical_ids(lambda_name_or_ref, defined_logical_ids))
-            elif isinstance(authorizer_uri_ref, dict):
-                 # Handle cases like !Sub in AuthorizerUri
-                 lambda_ids.update(find_logical_ids(authorizer_uri_ref, defined_logical_ids))
-
-
-            if api_ids and lambda_ids:
-                 api_logical_id = list(api_ids)[0]
-                 lambda_logical_id = list(lambda_ids)[0]
-                 # API Gateway invokes the Authorizer Lambda
-                 print(f"  {api_logical_id} (API Gateway via Authorizer {logical_id}) -> {lambda_logical_id}")
-                 # Ensure API resource exists in structure
-                 if api_logical_id in parsed_relations:
-                     parsed_relations[api_logical_id]['invokes'].add(lambda_logical_id)
-                 else:
-                     print(f"  Warning: RestApi '{api_logical_id}' for Authorizer '{logical_id}' not found in this template.")
-            elif rest_api_ref and authorizer_uri_ref:
-                 print(f"  Warning: Could not fully resolve RestApiId ({rest_api_ref}) or Lambda from AuthorizerUri ({authorizer_uri_ref}) for Authorizer '{logical_id}'.")
-
-        # --- NEW: Handle CloudFront Lambda@Edge ---
-        elif cfn_type == "AWS::CloudFront::Distribution":
-            dist_config = properties.get('DistributionConfig', {})
-            lambda_associations = []
-            # Check default cache behavior
-            default_behavior = dist_config.get('DefaultCacheBehavior', {})
-            lambda_associations.extend(default_behavior.get('LambdaFunctionAssociations', []))
-            # Check other cache behaviors
-            for behavior in dist_config.get('CacheBehaviors', []):
-                 lambda_associations.extend(behavior.get('LambdaFunctionAssociations', []))
-            
-            invoked_lambda_ids = set()
-            for assoc in lambda_associations:
-                 lambda_arn_with_version = assoc.get('LambdaFunctionARN')
-                 if isinstance(lambda_arn_with_version, str):
-                     # Attempt to remove potential version suffix
-                     base_lambda_arn = lambda_arn_with_version.split(':')[:-1] # Remove potential version/alias
-                     base_lambda_arn = ":".join(base_lambda_arn)
-                     # Try resolving the base ARN
-                     lambda_ids = find_logical_ids(base_lambda_arn, defined_logical_ids)
-                     if not lambda_ids:
-                         # Also try resolving the original ARN in case it was a direct !Ref without version
-                          lambda_ids = find_logical_ids(lambda_arn_with_version, defined_logical_ids)
-                     invoked_lambda_ids.update(lambda_ids)
-                 elif isinstance(lambda_arn_with_version, dict): # Handle !Ref, !GetAtt
-                     # find_logical_ids should handle resolving refs/getatts
-                     invoked_lambda_ids.update(find_logical_ids(lambda_arn_with_version, defined_logical_ids))
-
-            for lambda_id in invoked_lambda_ids:
-                 if lambda_id in resources:
-                     # CloudFront distribution invokes the Lambda@Edge function
-                     print(f"  {logical_id} (CloudFront Distribution) -> {lambda_id} (Lambda@Edge)")
-                     parsed_relations[logical_id]['invokes'].add(lambda_id)
-                 else:
-                      print(f"  Warning: Lambda@Edge function '{lambda_id}' for CloudFront Distribution '{logical_id}' not found in this template.")
-
+        handler = RESOURCE_HANDLERS.get(cfn_type)
+        if handler:
+            handler(logical_id, cfn_type, properties, context)
 
     # Second pass: Format the output structure for this template
     print("Formatting results for this template...")
     final_relations = {}
-    # Include both defined resources and any created service pseudo-resources
-    all_ids_to_process = set(parsed_relations.keys())
+    # Display type per original type, resolved once instead of per resource and per edge
+    display_types = {}
 
-    for logical_id in all_ids_to_process:
-        data = parsed_relations[logical_id]
+    # Include both defined resources (in template order) and any created service pseudo-resources
+    for logical_id, data in parsed_relations.items():
         original_type = data.get('_original_type', 'Unknown')
-        display_type = CFN_TYPE_MAP.get(original_type, original_type) # Use map, fallback to original
+        display_type = display_types.get(original_type)
+        if display_type is None:
+            display_type = display_types[original_type] = CFN_TYPE_MAP.get(original_type, original_type) # Use map, fallback to original
 
         # Format the 'invokes' list
         final_invokes = []
-        for target_name in sorted(list(data.get('invokes', set()))):
+        for target_name in sorted(data.get('invokes', ())):
              target_info = {}
-             if target_name in parsed_relations: # Check if target exists in *our collected data*
+             target_data = parsed_relations.get(target_name)
+             if target_data is not None: # Check if target exists in *our collected data*
                  # Target is defined in this template or is another pseudo-resource
-                 target_original_type = parsed_relations[target_name].get('_original_type', 'Unknown')
+                 target_original_type = target_data.get('_original_type', 'Unknown')
+                 target_display_type = display_types.get(target_original_type)
+                 if target_display_type is None:
+                     target_display_type = display_types[target_original_type] = CFN_TYPE_MAP.get(target_original_type, target_original_type)
                  target_info = {
                      "name": target_name,
-                     "type": CFN_TYPE_MAP.get(target_original_type, target_original_type),
-                     "account_name": parsed_relations[target_name].get('account_name', account_name) # Use target's account
+                     "type": target_display_type,
+                     "account_name": target_data.get('account_name', account_name) # Use target's account
                  }
              else:
                   # Target is referenced but not defined in this template (likely external CFN stack)
                   # Note: This case becomes less likely for service pseudo-resources as they are created on the fly
-                  print(f"  Info: Resource '{target_name}' invoked by '{logical_id}' is likely external or in another template.")
+                  logger.debug("Info: Resource '%s' invoked by '%s' is likely external or in another template.", target_name, logical_id)
                   target_info = {
                      "name": target_name,
                      "type": "Unknown/External",
@@ -768,9 +968,12 @@ def load_existing_data(data_file_path):
     if not os.path.exists(data_file_path):
         return {}
     try:
+        if orjson is not None:
+            with open(data_file_path, 'rb') as f:
+                return orjson.loads(f.read())
         with open(data_file_path, 'r') as f:
             return json.load(f)
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e: # orjson.JSONDecodeError is a subclass
         print(f"Warning: Could not decode existing data file {data_file_path}. Starting fresh. Error: {e}", file=sys.stderr)
         return {}
     except IOError as e:
@@ -779,25 +982,52 @@ def load_existing_data(data_file_path):
 
 def write_data_file(relations, output_path="resources.json"):
     """Writes the relations dictionary (invokes only) to the specified JSON file."""
-    print(f"Writing combined data (invokes only) to {output_path}...")
-    output_data = {}
-    # Convert sets to lists for JSON serialization before writing
-    for logical_id, data in relations.items():
-        # Ensure essential keys exist before copying
-        data.setdefault('type', 'Unknown')
-        data.setdefault('account_name', 'Unknown')
-        data.setdefault('invokes', [])
-        output_data[logical_id] = data.copy() # Shallow copy is fine
+    # Essential keys are guaranteed by parse_cloudformation and the load step in __main__,
+    # and serializing doesn't modify anything, so the relations are written as they are.
+    # Serialize in one go and write once; json.dump with indent streams many small chunks.
+    # The stdlib encoder is kept for output because orjson can only indent by two spaces.
+    output = json.dumps(relations, indent=4)
+
+    # Re-running on unchanged templates reproduces the file byte for byte; don't rewrite it then.
+    # The output is ASCII (ensure_ascii), so its length is its size on disk.
+    try:
+        if os.path.getsize(output_path) == len(output):
+            with open(output_path, 'r') as f:
+                if f.read() == output:
+                    print(f"Data in {output_path} is already up to date. Skipping write.")
+                    return
+    except OSError:
+        pass # Missing or unreadable; just write it
 
+    print(f"Writing combined data (invokes only) to {output_path}...")
+    # Write to a temporary file and swap it in, so a failed write never leaves a truncated data file
+    tmp_output_path = f"{output_path}.tmp"
     try:
-        with open(output_path, 'w') as f:
-            json.dump(output_data, f, indent=4) # Write the formatted data
+        with open(tmp_output_path, 'w') as f:
+            f.write(output) # Write the formatted data
+        os.replace(tmp_output_path, output_path)
         print(f"Successfully wrote data to {output_path}.")
     except IOError as e:
         print(f"Error writing to file {output_path}: {e}", file=sys.stderr)
+        if os.path.exists(tmp_output_path):
+            os.remove(tmp_output_path)
         # Don't exit, just report error
 # --- Read/Write JSON Data File --- END
 
+def configure_logging(verbose):
+    """Shows per-relationship debug output with --verbose, otherwise only warnings.
+
+    Errors (unparseable Step Function definitions) go to stderr, everything else to stdout.
+    """
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.addFilter(lambda record: record.levelno < logging.ERROR)
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setLevel(logging.ERROR)
+    logging.basicConfig(level=logging.WARNING, format="  %(message)s",
+                        handlers=[stdout_handler, stderr_handler])
+    # Only this script's logger goes down to DEBUG; third-party libraries stay at WARNING
+    logger.setLevel(logging.DEBUG if verbose else logging.WARNING)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Parse CloudFormation templates and update a JSON resource relationship data file (generates invokes, including pseudo-services; run invoked_by script afterwards). "
@@ -811,9 +1041,16 @@ if __name__ == "__main__":
     )
     parser.add_argument("-o", "--output", default="resources.json",
                         help="Path to the output/update JSON data file (default: resources.json)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Print every inferred relationship and informational note while parsing")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of templates to parse in parallel processes (default: 1). "
+                             "Results are still merged in command-line order; parser output may interleave.")
 
     args = parser.parse_args()
 
+    configure_logging(args.verbose)
+
     if len(args.template_account_pairs) % 2 != 0:
         parser.error("Arguments must be provided in pairs of <template_file> <account_name>.")
         sys.exit(1)
@@ -823,17 +1060,30 @@ if __name__ == "__main__":
     # including merging service pseudo-resources defined by permissions in different templates
     all_relations_data = load_existing_data(output_file)
     print(f"Loaded {len(all_relations_data)} existing resource definitions from {output_file}")
+    # Ensure essential keys exist in loaded entries; freshly parsed entries always have them
+    for res_data in all_relations_data.values():
+        res_data.setdefault('type', 'Unknown')
+        res_data.setdefault('account_name', 'Unknown')
+        res_data.setdefault('invokes', [])
 
     print(f"Processing {len(args.template_account_pairs) // 2} template(s) from command line...")
 
-    new_data_parsed = False
-    for i in range(0, len(args.template_account_pairs), 2):
-        template_file = args.template_account_pairs[i]
-        account_name = args.template_account_pairs[i+1]
+    template_files = args.template_account_pairs[0::2]
+    account_names = args.template_account_pairs[1::2]
+    parallel_results = None
+    if args.jobs > 1 and len(template_files) > 1:
+        # Templates are independent, so parse them up front in worker processes
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=configure_logging, initargs=(args.verbose,)) as pool:
+            parallel_results = list(pool.map(parse_cloudformation, template_files, account_names))
 
+    new_data_parsed = False
+    for i, (template_file, account_name) in enumerate(zip(template_files, account_names)):
         print(f"\n--- Parsing: {template_file} (Account: {account_name}) ---")
         # Parse the current template
-        relations_data = parse_cloudformation(template_file, account_name)
+        if parallel_results is not None:
+            relations_data = parallel_results[i]
+        else:
+            relations_data = parse_cloudformation(template_file, account_name)
 
         if relations_data:
             print(f"Merging data from {template_file}...")
@@ -841,11 +1091,12 @@ if __name__ == "__main__":
             for res_id, res_data in relations_data.items():
                 if res_id in all_relations_data:
                     # If resource already exists (e.g., service pseudo-resource), update its invokes list
-                    existing_invokes = set(tuple(sorted(d.items())) for d in all_relations_data[res_id].get('invokes', []))
-                    new_invokes = set(tuple(sorted(d.items())) for d in res_data.get('invokes', []))
-                    merged_invokes_tuples = existing_invokes.union(new_invokes)
-                    # Convert tuples back to dictionaries
-                    all_relations_data[res_id]['invokes'] = sorted([dict(t) for t in merged_invokes_tuples], key=lambda x: x['name'])
+                    # Key entries by their fields instead of round-tripping every dict through sorted item tuples
+                    merged_invokes = {}
+                    for invokes_list in (all_relations_data[res_id].get('invokes', []), res_data.get('invokes', [])):
+                        for d in invokes_list:
+                            merged_invokes.setdefault((d.get('name'), d.get('type'), d.get('account_name')), d)
+                    all_relations_data[res_id]['invokes'] = sorted(merged_invokes.values(), key=lambda x: x['name'])
 
                     # Update type and account only if the new data is more specific (e.g. not 'Unknown')
                     if res_data.get('type') and res_data['type'] != 'Unknown':
@@ -862,12 +1113,6 @@ if __name__ == "__main__":
 
     # Write the combined data (without invoked_by) at the end
     if new_data_parsed or all_relations_data:
-        # Final check to ensure essential keys exist in all entries before writing
-        for res_id, res_data in all_relations_data.items():
-            res_data.setdefault('type', 'Unknown')
-            res_data.setdefault('account_name', 'Unknown')
-            res_data.setdefault('invokes', [])
-
         write_data_file(all_relations_data, output_file)
     else:
         print("No data parsed or loaded. Output file not created or modified.")
@@ -2,15 +2,24 @@ import sys
 import json
 import os
 
+# orjson is optional; it parses large data files considerably faster than the stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # --- Load data from JSON file --- START
 def load_data(file_path="resources.json"):
     if not os.path.exists(file_path):
         print(f"Error: Data file '{file_path}' not found. Please generate it first.", file=sys.stderr)
         sys.exit(1)
     try:
+        if orjson is not None:
+            with open(file_path, 'rb') as f:
+                return orjson.loads(f.read())
         with open(file_path, 'r') as f:
             return json.load(f)
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e: # orjson.JSONDecodeError is a subclass
         print(f"Error: Could not decode data file '{file_path}'. Invalid JSON. Error: {e}", file=sys.stderr)
         sys.exit(1)
     except IOError as e:
@@ -20,8 +29,8 @@ def load_data(file_path="resources.json"):
 resource_relations = load_data()
 # --- Load data from JSON file --- END
 
-# Create a mapping for case-insensitive lookup
-lowercase_map = {k.lower(): k for k in resource_relations}
+# Mapping for case-insensitive lookup; only built once a name doesn't match exactly
+lowercase_map = None
 
 def print_table(title, items, start_index):
     # This function assumes items list is not empty, check before calling.
@@ -50,21 +59,16 @@ def print_table(title, items, start_index):
     row_separator = f"├{'─' * (index_width + 2)}┼{'─' * (name_width + 2)}┼{'─' * (type_width + 2)}┼{'─' * (account_width + 2)}┤"
     bottom_border = f"└{'─' * (index_width + 2)}┴{'─' * (name_width + 2)}┴{'─' * (type_width + 2)}┴{'─' * (account_width + 2)}┘"
 
-    print(top_border)
-    print(title_line)
-    print(header_separator)
-    print(header_line)
-    print(row_separator)
-
-    current_index = start_index
-    for i, item in enumerate(items):
-        print(f"│ {str(current_index).rjust(index_width)} │ {item['name'].ljust(name_width)} │ {item['type'].ljust(type_width)} │ {item['account_name'].ljust(account_width)} │")
-        if i < len(items) - 1:
-            print(row_separator)
-        current_index += 1
-    print(bottom_border)
-
-    print()
+    # Build the whole table and write it at once instead of printing line by line
+    rows = [
+        f"│ {str(index).rjust(index_width)} │ {item['name'].ljust(name_width)} │ {item['type'].ljust(type_width)} │ {item['account_name'].ljust(account_width)} │"
+        for index, item in enumerate(items, start_index)
+    ]
+    lines = [top_border, title_line, header_separator, header_line, row_separator]
+    lines.append(f"\n{row_separator}\n".join(rows))
+    lines.append(bottom_border)
+
+    sys.stdout.write("\n".join(lines) + "\n\n")
     return len(items)
 
 def display_and_select_resource(resource_name):
@@ -121,8 +125,13 @@ while True:
         print("Exiting.")
         break
 
-    start_resource_lower = start_resource_input.lower()
-    canonical_name = lowercase_map.get(start_resource_lower)
+    if start_resource_input in resource_relations:
+        canonical_name = start_resource_input
+    else:
+        if lowercase_map is None:
+            lowercase_map = {k.lower(): k for k in resource_relations}
+        start_resource_lower = start_resource_input.lower()
+        canonical_name = lowercase_map.get(start_resource_lower)
 
     if canonical_name:
         display_and_select_resource(canonical_name)
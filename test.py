@@ -1,6 +1,13 @@
 import json
 import sys
 import os
+import argparse
+
+# orjson is optional; it parses large data files considerably faster than the stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- Load data from JSON file --- START
 def load_data(file_path="resources.json"):
@@ -8,9 +15,12 @@ def load_data(file_path="resources.json"):
         print(f"Error: Data file '{file_path}' not found. Please generate it first.", file=sys.stderr)
         return None # Return None on error, let caller handle exit
     try:
+        if orjson is not None:
+            with open(file_path, 'rb') as f:
+                return orjson.loads(f.read())
         with open(file_path, 'r') as f:
             return json.load(f)
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e: # orjson.JSONDecodeError is a subclass
         print(f"Error: Could not decode data file '{file_path}'. Invalid JSON. Error: {e}", file=sys.stderr)
         return None
     except IOError as e:
@@ -18,51 +28,88 @@ def load_data(file_path="resources.json"):
         return None
 # --- Load data from JSON file --- END
 
-def validate_resource_data(resource_relations):
-    """Checks if all mentioned resources have definitions and if relationships are reciprocal."""
-    defined_resources = set(resource_relations.keys())
+def report_validation_result(errors_found):
+    """Prints the final validation verdict and returns True if validation passed."""
+    if errors_found:
+        print("\nValidation FAILED.")
+    else:
+        print("\nValidation SUCCESSFUL: All checks passed.")
+
+    return not errors_found
+
+def validate_resource_data(resource_relations, fail_fast=False):
+    """Checks if all mentioned resources have definitions and if relationships are reciprocal.
+
+    With fail_fast, validation stops and fails at the first check that finds an error.
+    """
+    # Intern resource names: the keys become the shared copies, and interning the names listed
+    # in invokes/invoked_by below maps them onto those, so set lookups match by identity
+    defined_resources = {sys.intern(name) for name in resource_relations}
     mentioned_resources = set()
-    missing_definitions = set()
-    reciprocity_errors = [] # List to store reciprocity error messages
+    reciprocity_errors = [] # (resource, 'invokes'/'is invoked_by', other resource); messages are formatted when reported
     errors_found = False
 
     print("Starting resource data validation...")
 
-    # 1. Gather all mentioned resources and check for definitions
+    # Names listed by each resource, so every reciprocity check below is a hash lookup instead of a list scan.
+    # Dicts (keys only) rather than sets keep the names in list order, so --fail-fast reports the same error every run.
+    invokes_names = {}
+    invoked_by_names = {}
+
+    # 1. Gather all mentioned resources (and each resource's listed names) and check for definitions
     print("Checking for missing resource definitions...")
     for resource_name, data in resource_relations.items():
-        for item in data.get("invokes", []):
+        names = invokes_names[resource_name] = {}
+        named_entries = 0
+        for item in data.get("invokes", ()):
             # Ensure 'name' key exists before adding
             if 'name' in item:
-                 mentioned_resources.add(item['name'])
+                 named_entries += 1
+                 name = item['name']
+                 names[sys.intern(name) if isinstance(name, str) else name] = None
             else:
                  print(f"  - Warning: Entry in 'invokes' list of '{resource_name}' is missing 'name' key.")
                  errors_found = True # Treat malformed entry as an error
-        for item in data.get("invoked_by", []):
+                 if fail_fast:
+                     return report_validation_result(errors_found)
+        if named_entries != len(names):
+            # Duplicates are reported but not counted as errors; each pair is checked only once
+            print(f"  - Warning: 'invokes' list of '{resource_name}' contains {named_entries - len(names)} duplicate entries.")
+        mentioned_resources.update(names)
+        names = invoked_by_names[resource_name] = {}
+        named_entries = 0
+        for item in data.get("invoked_by", ()):
              if 'name' in item:
-                 mentioned_resources.add(item['name'])
+                 named_entries += 1
+                 name = item['name']
+                 names[sys.intern(name) if isinstance(name, str) else name] = None
              else:
                  print(f"  - Warning: Entry in 'invoked_by' list of '{resource_name}' is missing 'name' key.")
                  errors_found = True # Treat malformed entry as an error
+                 if fail_fast:
+                     return report_validation_result(errors_found)
+        if named_entries != len(names):
+            print(f"  - Warning: 'invoked_by' list of '{resource_name}' contains {named_entries - len(names)} duplicate entries.")
+        mentioned_resources.update(names)
 
-    for mentioned_name in mentioned_resources:
-        if mentioned_name not in defined_resources:
-            missing_definitions.add(mentioned_name)
-            errors_found = True
-
+    missing_definitions = mentioned_resources - defined_resources
     if missing_definitions:
-        print("\nDefinition Errors Found:")
-        for missing_name in sorted(list(missing_definitions)):
-            print(f"  - Error: Resource '{missing_name}' is mentioned but has no definition.")
+        errors_found = True
+        # Build the whole report and write it at once instead of printing line by line
+        lines = ["\nDefinition Errors Found:"]
+        lines.extend(f"  - Error: Resource '{missing_name}' is mentioned but has no definition." for missing_name in sorted(missing_definitions))
+        sys.stdout.write("\n".join(lines) + "\n")
+        if fail_fast:
+            return report_validation_result(errors_found)
     else:
          print("Definition check passed.")
 
     # 2. Check for reciprocal relationships
     print("\nChecking for reciprocal relationships...")
-    for source_name, source_data in resource_relations.items():
+    # Iterate the distinct names gathered above, so a duplicated entry is only checked once
+    for source_name in resource_relations:
         # Check invokes list
-        for target_info in source_data.get("invokes", []):
-            target_name = target_info.get('name')
+        for target_name in invokes_names[source_name]:
             if not target_name:
                  continue # Skip if name is missing (already warned)
 
@@ -70,17 +117,19 @@ def validate_resource_data(resource_relations):
             if target_name not in defined_resources:
                 continue
 
-            target_data = resource_relations[target_name]
             # Check if source_name is in target's invoked_by list
-            found_invoked_by = any(invoker.get('name') == source_name for invoker in target_data.get("invoked_by", []))
+            found_invoked_by = source_name in invoked_by_names[target_name]
             if not found_invoked_by:
                 errors_found = True
-                error_msg = f"  - Reciprocity Error: '{source_name}' invokes '{target_name}', but '{target_name}' does not list '{source_name}' in invoked_by."
-                reciprocity_errors.append(error_msg)
+                reciprocity_errors.append((source_name, 'invokes', target_name))
+                if fail_fast:
+                    break
+
+        if fail_fast and reciprocity_errors:
+            break # Report the first reciprocity error only
 
         # Check invoked_by list
-        for invoker_info in source_data.get("invoked_by", []):
-            invoker_name = invoker_info.get('name')
+        for invoker_name in invoked_by_names[source_name]:
             if not invoker_name:
                 continue # Skip if name is missing (already warned)
 
@@ -88,38 +137,49 @@ def validate_resource_data(resource_relations):
             if invoker_name not in defined_resources:
                  continue
 
-            invoker_data = resource_relations[invoker_name]
             # Check if source_name is in invoker's invokes list
-            found_invokes = any(target.get('name') == source_name for target in invoker_data.get("invokes", []))
+            found_invokes = source_name in invokes_names[invoker_name]
             if not found_invokes:
                 errors_found = True
-                error_msg = f"  - Reciprocity Error: '{source_name}' is invoked_by '{invoker_name}', but '{invoker_name}' does not list '{source_name}' in invokes."
-                reciprocity_errors.append(error_msg)
+                reciprocity_errors.append((source_name, 'is invoked_by', invoker_name))
+                if fail_fast:
+                    break
+
+        if fail_fast and reciprocity_errors:
+            break # Report the first reciprocity error only
 
     if reciprocity_errors:
-        print("\nReciprocity Errors Found:")
-        for error in sorted(reciprocity_errors):
-            print(error)
+        lines = ["\nReciprocity Errors Found:"]
+        for source_name, relation, other_name in sorted(reciprocity_errors):
+            if relation == 'invokes':
+                lines.append(f"  - Reciprocity Error: '{source_name}' invokes '{other_name}', but '{other_name}' does not list '{source_name}' in invoked_by.")
+            else:
+                lines.append(f"  - Reciprocity Error: '{source_name}' is invoked_by '{other_name}', but '{other_name}' does not list '{source_name}' in invokes.")
+        sys.stdout.write("\n".join(lines) + "\n")
     else:
         print("Reciprocity check passed.")
 
-
     # Final Report
-    if errors_found:
-        print("\nValidation FAILED.")
-    else:
-        print("\nValidation SUCCESSFUL: All checks passed.")
-
-    return not errors_found
+    return report_validation_result(errors_found)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Validates resources.json: every mentioned resource is defined and invokes/invoked_by are reciprocal."
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stop at the first check that finds an error instead of reporting every error"
+    )
+    args = parser.parse_args()
+
     # Load data first
     data = load_data()
     if data is None:
         sys.exit(1) # Exit if data loading failed
     
     # Pass data to validation function
-    if validate_resource_data(data):
+    if validate_resource_data(data, fail_fast=args.fail_fast):
         pass
     else:
         sys.exit(1) 
\ No newline at end of file